@@ -38,7 +38,19 @@ BATCHIMPORT_UNEDITABLE_FIELDS = get_setting('BATCHIMPORT_UNEDITABLE_FIELDS', Fal
 # each fully specified model field.
 # NOTE: You must import the item into your settings file if it is a 
 # callable.
+# Callables can also be given as the dotted path to a function. They are
+# called with the request and the cell value, and must return the value
+# to use. Overrides are resolved when the import options are submitted;
+# strings that don't name a function that can be imported (such as
+# 'example.com') are constants.
+# For example :
+#   {'school.models.Student': {'teacher': 'school.utils.get_teacher',
+#                              'year': 2014}}
+# Functions decorated with batchimport.utils.cacheable_override are
+# only called once per distinct cell value during an import; this is
+# the maximum number of values remembered for each of them.
 BATCHIMPORT_VALUE_OVERRIDES = get_setting('BATCHIMPORT_VALUE_OVERRIDES', {})
+BATCHIMPORT_VALUE_OVERRIDE_CACHE_SIZE = get_setting('BATCHIMPORT_VALUE_OVERRIDE_CACHE_SIZE', 10000)
 
 BATCHIMPORT_IMPORTABLE_MODELS = get_setting('BATCHIMPORT_IMPORTABLE_MODELS', {})
 
@@ -49,6 +61,13 @@ BATCHIMPORT_IMPORTABLE_MODELS = get_setting('BATCHIMPORT_IMPORTABLE_MODELS', {})
 BATCHIMPORT_SHOW_SUCCESSFUL_IMPORTS = get_setting('BATCHIMPORT_SHOW_SUCCESSFUL_IMPORTS', True)
 BATCHIMPORT_SHOW_SUCCESSFUL_UPDATES = get_setting('BATCHIMPORT_SHOW_SUCCESSFUL_UPDATES', True)
 
+# Only the first BATCHIMPORT_RESULT_SAMPLE_SIZE messages of each kind
+# (imports, updates, errors) are kept in memory and shown on the
+# results page. The full list is written to a result log in
+# BATCHIMPORT_TEMPDIR (see batchimport.results), which can be read a
+# page at a time from the results view.
+BATCHIMPORT_RESULT_SAMPLE_SIZE = get_setting('BATCHIMPORT_RESULT_SAMPLE_SIZE', 100)
+
 
 # Whether the system should stop on the first error
 # or process the entire uploaded spreadsheet and show
@@ -62,8 +81,100 @@ BATCHIMPORT_STOP_ON_FIRST_ERROR = get_setting('BATCHIMPORT_STOP_ON_FIRST_ERROR',
 # must match at all column/fields.
 BATCHIMPORT_UPDATE_DUPS = get_setting('BATCHIMPORT_UPDATE_DUPS', False)
 
+# Whether to only validate the spreadsheet: rows are checked and
+# reported as they would be by the import, but nothing is written
+# to the database.
+BATCHIMPORT_VALIDATE_ONLY = get_setting('BATCHIMPORT_VALIDATE_ONLY', False)
+
 # If no options are set for start/end row, defaults are used that
 # assume (1) the spreadsheet has a header row (indicating that data
 # starts on row #2 and (2) the entire spreadsheet is to be processed.
 BATCHIMPORT_START_ROW = get_setting('BATCHIMPORT_START_ROW', 2)
 BATCHIMPORT_END_ROW = get_setting('BATCHIMPORT_END_ROW', -1)
+
+# Rows are processed in batches of BATCHIMPORT_BATCH_SIZE rows: the
+# objects already in the database for a whole batch are looked up
+# with a single query. New objects can also be written per batch
+# using the manager's bulk_create() instead of being saved one row
+# at a time, and the changed fields of updated objects are written
+# using batched UPDATE queries. This is a lot faster on big
+# spreadsheets but model save() methods and pre/post_save signals
+# are NOT called for objects created or updated this way.
+# Either way, only the fields that actually changed are written
+# when updating an existing object.
+BATCHIMPORT_BULK_CREATE = get_setting('BATCHIMPORT_BULK_CREATE', False)
+BATCHIMPORT_BATCH_SIZE = get_setting('BATCHIMPORT_BATCH_SIZE', 500)
+
+# Cell values imported into date, time, number and boolean fields are
+# converted to native values (date, datetime, Decimal...) using the
+# model fields. The conversions of this many distinct values are
+# remembered for each column.
+BATCHIMPORT_CONVERSION_MEMO_SIZE = get_setting('BATCHIMPORT_CONVERSION_MEMO_SIZE', 1000)
+
+# Related objects (found using the "mapping field" chosen for a
+# related field) are cached for the duration of an import, so that
+# a value repeated on many rows only costs one query. This is the
+# maximum number of (related model, mapping field, value) entries
+# kept in that cache. Use 0 to disable the cache.
+BATCHIMPORT_RELATED_OBJECT_CACHE_SIZE = get_setting('BATCHIMPORT_RELATED_OBJECT_CACHE_SIZE', 10000)
+
+# How related objects are looked up for related fields that have a
+# mapping field:
+#  - 'prefetch' loads the whole related table once per import,
+#  - 'batch' looks up all the values of a batch of rows in one query,
+#  - 'query' looks up each (uncached) value on its own.
+# By default, 'prefetch' is used for related tables that have at most
+# BATCHIMPORT_RELATED_PREFETCH_MAX_ROWS rows, and 'batch' otherwise.
+# The strategy can be forced for specific fields, using a dictionary
+# laid out like BATCHIMPORT_VALUE_OVERRIDES, for example :
+#   {'school.models.Student': {'teacher': 'query'}}
+# Unknown strategy names raise ImproperlyConfigured.
+BATCHIMPORT_RELATED_PREFETCH_MAX_ROWS = get_setting('BATCHIMPORT_RELATED_PREFETCH_MAX_ROWS', 1000)
+BATCHIMPORT_RELATED_LOOKUP_STRATEGIES = get_setting('BATCHIMPORT_RELATED_LOOKUP_STRATEGIES', {})
+
+# CSV/TSV files are read using the csv module. The dialect is the
+# name of a registered csv dialect (such as 'excel' or 'excel-tab'),
+# if None it is guessed from the file. The encoding is used to decode
+# cell values ('utf-8-sig' is UTF-8 with or without a BOM).
+BATCHIMPORT_CSV_DIALECT = get_setting('BATCHIMPORT_CSV_DIALECT', None)
+BATCHIMPORT_CSV_ENCODING = get_setting('BATCHIMPORT_CSV_ENCODING', 'utf-8-sig')
+
+# Imports can run in the background instead of inside the HTTP
+# request (see batchimport.jobs): set BATCHIMPORT_JOB_BACKEND to
+# 'thread' to use a pool of threads in the web process, or to
+# 'process' to use a pool of worker processes. With None, imports
+# run synchronously in ImportRunView. BATCHIMPORT_JOB_WORKERS is
+# the number of imports that can run at the same time.
+BATCHIMPORT_JOB_BACKEND = get_setting('BATCHIMPORT_JOB_BACKEND', None)
+BATCHIMPORT_JOB_WORKERS = get_setting('BATCHIMPORT_JOB_WORKERS', 2)
+
+# Running jobs record a heartbeat as they make progress. A running job
+# whose heartbeat is older than BATCHIMPORT_JOB_LEASE seconds is
+# considered dead (its worker was killed, for example), and can be
+# resumed.
+BATCHIMPORT_JOB_LEASE = get_setting('BATCHIMPORT_JOB_LEASE', 600)
+
+# The progress of running imports is published (to the Django cache,
+# see batchimport.progress) every BATCHIMPORT_PROGRESS_ROWS processed
+# rows, or every BATCHIMPORT_PROGRESS_INTERVAL seconds, whichever
+# comes first.
+BATCHIMPORT_PROGRESS_ROWS = get_setting('BATCHIMPORT_PROGRESS_ROWS', 1000)
+BATCHIMPORT_PROGRESS_INTERVAL = get_setting('BATCHIMPORT_PROGRESS_INTERVAL', 1.0)
+
+# Object imports can run in parallel, in several processes that each
+# import a share of the rows (rows representing the same object are
+# always imported by the same process). This is the default number
+# of processes; 1 disables parallel imports.
+BATCHIMPORT_PARALLEL_WORKERS = get_setting('BATCHIMPORT_PARALLEL_WORKERS', 1)
+
+# Import plans (see batchimport.plans) are stored as files in
+# BATCHIMPORT_TEMPDIR. Plans that haven't been saved again for
+# BATCHIMPORT_PLAN_MAX_AGE seconds are deleted whenever a plan is
+# saved; None keeps them forever.
+BATCHIMPORT_PLAN_MAX_AGE = get_setting('BATCHIMPORT_PLAN_MAX_AGE', 7 * 24 * 60 * 60)
+
+# Imported rows are committed in chunks of (at least, as whole batches
+# of rows are committed together) BATCHIMPORT_TRANSACTION_SIZE rows
+# instead of one row at a time. Each row is written in a savepoint,
+# so that a failing row is rolled back alone.
+BATCHIMPORT_TRANSACTION_SIZE = get_setting('BATCHIMPORT_TRANSACTION_SIZE', 1000)
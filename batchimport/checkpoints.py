@@ -0,0 +1,63 @@
+"""
+Checkpoints of running imports.
+
+After each chunk of rows is committed (see BATCHIMPORT_TRANSACTION_SIZE),
+the import functions (see batchimport.parser) record a checkpoint: the last
+committed row, the counters of the import so far and the size of its result
+log (see batchimport.results) at that point. Checkpoints are small JSON
+files in BATCHIMPORT_TEMPDIR, replaced atomically and synced to disk, so
+that they survive the death of the process running the import.
+
+An import that didn't finish can then be resumed from its checkpoint
+instead of starting over: the rows up to the checkpoint aren't read again,
+and the result log is truncated back to the checkpoint, which drops the
+messages of the rows whose chunk was rolled back. The checkpoint of an
+import is deleted once the import has finished.
+
+"""
+import json
+import os
+from os.path import join
+
+from batchimport.batchimport_settings import *
+
+# Counters of the status dictionary saved in checkpoints.
+CHECKPOINT_COUNTER_KEYS = ('processed_count', 'imported_count', 'updated_count',
+                           'unchanged_count', 'error_count')
+
+
+def get_checkpoint_path(import_id):
+    return join(BATCHIMPORT_TEMPDIR, 'batchimport_checkpoint_%s.json' % import_id)
+
+
+def save_checkpoint(import_id, checkpoint_dict):
+    """
+    Record ``checkpoint_dict`` as the checkpoint of the import identified by
+    ``import_id``. The previous checkpoint is only replaced once the new one
+    is safely on disk.
+
+    """
+    path = get_checkpoint_path(import_id)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        json.dump(checkpoint_dict, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp_path, path)
+
+
+def load_checkpoint(import_id):
+    """Return the checkpoint of the import identified by ``import_id``, or
+    None if there is none."""
+    try:
+        with open(get_checkpoint_path(import_id), 'rb') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def delete_checkpoint(import_id):
+    try:
+        os.remove(get_checkpoint_path(import_id))
+    except OSError:
+        pass
@@ -0,0 +1,113 @@
+"""
+Conversion of cell values to the values of the model fields they are
+imported into.
+
+The readers (see batchimport.readers) return native cell values: text,
+numbers, booleans and ``datetime`` objects for date cells. Before being
+handed to the model, the values of the columns mapped to typed fields
+(dates, times, numbers, booleans) are converted using the field's
+``to_python``, so that the objects get ``date``, ``datetime``, ``Decimal``
+(...) values instead of whatever the spreadsheet held. The converter of a
+column is chosen once, when the import info is built (see
+ModelImportInfo._compile_column_plans), and it remembers the conversions
+of the first distinct values it sees, so that columns holding few distinct
+values (dates, categories, flags) are only parsed once per value.
+
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from batchimport.batchimport_settings import *
+
+# Fields whose values are converted using their to_python (the date/time
+# fields and DecimalField are handled separately).
+TO_PYTHON_FIELD_CLASSES = (models.IntegerField, models.FloatField,
+                           models.BooleanField, models.NullBooleanField)
+
+# Classes of the date cell values returned by the readers.
+DATE_VALUE_CLASSES = (datetime, date)
+
+
+def get_field_converter(field):
+    """
+    Return the converter for the values of the cells mapped to ``field``,
+    or None if the field isn't typed (text fields, for example, get the
+    cell value as is, see ``format_date_value``).
+
+    """
+    if isinstance(field, models.DateTimeField):
+        return ColumnConverter(_make_datetime_conversion(field))
+    if isinstance(field, (models.DateField, models.TimeField)):
+        return ColumnConverter(field.to_python)
+    if isinstance(field, models.DecimalField):
+        return ColumnConverter(_make_decimal_conversion(field))
+    if isinstance(field, TO_PYTHON_FIELD_CLASSES):
+        return ColumnConverter(field.to_python)
+    return None
+
+
+def format_date_value(value):
+    """Return date cell values as the 'Y-M-D' strings the readers used to
+    return, and other values unchanged. This is what text fields, related
+    fields and value overrides get."""
+    if isinstance(value, date):
+        return str(value.year) + '-' + str(value.month) + '-' + str(value.day)
+    return value
+
+
+class ColumnConverter(object):
+    """
+    Converts the values of a column using ``conversion``, a function taking
+    a cell value and returning the field value (or raising ValidationError).
+    The results for the first ``memo_size`` distinct values are remembered;
+    past that, the column is assumed to hold mostly distinct values and
+    the other values are simply converted every time.
+
+    """
+    def __init__(self, conversion, memo_size=None):
+        self.conversion = conversion
+        if memo_size is None:
+            memo_size = BATCHIMPORT_CONVERSION_MEMO_SIZE
+        self.memo_size = memo_size
+        self.memo = {}
+
+    def __call__(self, value):
+        # 1 and 1.0 (or u'1' and '1') are different cell values.
+        memo_key = (type(value), value)
+        try:
+            return self.memo[memo_key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable value, don't remember it.
+            return self.conversion(value)
+        converted_value = self.conversion(value)
+        if len(self.memo) < self.memo_size:
+            self.memo[memo_key] = converted_value
+        return converted_value
+
+
+def _make_datetime_conversion(field):
+    def convert_datetime(value):
+        value = field.to_python(value)
+        if settings.USE_TZ and value is not None and timezone.is_naive(value):
+            # Spreadsheets hold local times.
+            value = timezone.make_aware(value, timezone.get_default_timezone())
+        return value
+    return convert_datetime
+
+
+def _make_decimal_conversion(field):
+    exponent = Decimal(1).scaleb(-field.decimal_places)
+    def convert_decimal(value):
+        if isinstance(value, float):
+            # Decimal(0.1) would keep the binary approximation of 0.1, and
+            # 0.1 * 3 is 0.30000000000000004: round to the decimal places
+            # of the field, as the database will.
+            return Decimal(repr(value)).quantize(exponent)
+        return field.to_python(value)
+    return convert_decimal
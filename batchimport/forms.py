@@ -1,24 +1,35 @@
 from django import forms
 
-from batchimport.utils import get_model_list, get_column_choice_list, get_model_fields
+from batchimport.utils import get_importable_model_list, get_column_choice_list, get_importable_model_fields
 
 import batchimport.batchimport_settings
 
 
-import_model_list = get_model_list()
-
 class UploadImportFileForm(forms.Form):
-	model_for_import = forms.ChoiceField(import_model_list, label='What are you importing?')
-	import_file = forms.FileField(label='Select your XLS file:')
+	model_for_import = forms.ChoiceField(label='What are you importing?')
+	import_file = forms.FileField(label='Select your XLS, XLSX or CSV file:')
+	def __init__(self, *args, **kwargs):
+		super(UploadImportFileForm, self).__init__(*args, **kwargs)
+		# The list of importable models is built on first use (see
+		# batchimport.utils.get_importable_model_list), not when this
+		# module is imported.
+		self.fields['model_for_import'].choices = get_importable_model_list()
 
 class ImportOptionsForm(forms.Form):
 	show_successful_imports = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_SHOW_SUCCESSFUL_IMPORTS, required=False)
 	show_successful_updates = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_SHOW_SUCCESSFUL_UPDATES, required=False)
 	stop_on_first_error = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_STOP_ON_FIRST_ERROR, required=False)
 	update_dupes = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_UPDATE_DUPS, required=False)
+	validate_only = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_VALIDATE_ONLY, required=False)
 	start_row = forms.IntegerField(initial=batchimport.batchimport_settings.BATCHIMPORT_START_ROW, required=False)
 	end_row = forms.IntegerField(initial=batchimport.batchimport_settings.BATCHIMPORT_END_ROW, required=False)
+	bulk_create = forms.BooleanField(initial=batchimport.batchimport_settings.BATCHIMPORT_BULK_CREATE, required=False,
+		help_text='Write new objects and changed fields in batches, without calling save(). Otherwise each row is saved on its own.')
+	batch_size = forms.IntegerField(initial=batchimport.batchimport_settings.BATCHIMPORT_BATCH_SIZE, required=False, min_value=1)
+	transaction_size = forms.IntegerField(initial=batchimport.batchimport_settings.BATCHIMPORT_TRANSACTION_SIZE, required=False, min_value=1)
+	parallel_workers = forms.IntegerField(initial=batchimport.batchimport_settings.BATCHIMPORT_PARALLEL_WORKERS, required=False, min_value=1)
 	def __init__(self, model_for_import, save_file_name, *args, **kwargs):
+		file_hash = kwargs.pop('file_hash', None)
 		super(ImportOptionsForm, self).__init__(*args, **kwargs)
 		self.process_options = {}
 		
@@ -29,7 +40,7 @@ class ImportOptionsForm(forms.Form):
 		# Get a list of columns from the uploaded spreadsheet.
 		# This will be either a list of example values or a list
 		# of column headers.
-		xls_column_option_list = get_column_choice_list(save_file_name)
+		xls_column_option_list = get_column_choice_list(save_file_name, file_hash)
 		
 		# Get a list of field names from the selected model
 		# for import.
@@ -56,7 +67,7 @@ class ImportOptionsForm(forms.Form):
 			# - related_model_field_name_list: List of fields on the
 			#		related model (for mapping the current model's 
 			#		field to the related model).
-			model_field_tuple_list = get_model_fields(model_name, self.mapping_only)
+			model_field_tuple_list = get_importable_model_fields(model_name, self.mapping_only)
 			
 			# Iterate over this field_tuple_list and create a form field 
 			# for each of the following FOR EACH FIELD in the model:
@@ -131,8 +142,13 @@ class ImportOptionsForm(forms.Form):
 			process_options['show_successful_updates'] = self['show_successful_updates']
 			process_options['stop_on_first_error'] = self['stop_on_first_error']
 			process_options['update_dupes'] = self['update_dupes']
+			process_options['validate_only'] = self['validate_only']
 			process_options['start_row'] = self['start_row']
 			process_options['end_row'] = self['end_row']
+			process_options['bulk_create'] = self['bulk_create']
+			process_options['batch_size'] = self['batch_size']
+			process_options['transaction_size'] = self['transaction_size']
+			process_options['parallel_workers'] = self['parallel_workers']
 			self.process_options = process_options
 		return self.process_options
 		
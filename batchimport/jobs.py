@@ -0,0 +1,212 @@
+"""
+Background execution of imports.
+
+When BATCHIMPORT_JOB_BACKEND is set, ImportRunView doesn't run the import
+inside the HTTP request anymore: it records an ImportJob and hands it over
+to a local pool of workers, which are either threads of the web process
+('thread') or separate processes ('process'). The pool is created when the
+first job is submitted and holds BATCHIMPORT_JOB_WORKERS workers.
+
+Note that, as there is no HTTP request in the workers, value override
+functions get None as their ``request`` argument for these imports.
+
+Running jobs record a heartbeat as they make progress. A job that failed,
+or whose heartbeat is older than BATCHIMPORT_JOB_LEASE seconds (its worker
+died), can be resumed from its last checkpoint (see
+batchimport.checkpoints) using ``resume_import_job``.
+
+"""
+import json
+import os
+import threading
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from os.path import join
+
+from django.db import connections
+from django.utils import timezone
+
+from batchimport.batchimport_settings import *
+from batchimport.models import ImportJob
+from batchimport.parser import _init_status_dict, _do_import, _report_import_error
+from batchimport.progress import ImportProgress
+
+JOB_BACKEND_THREAD = 'thread'
+JOB_BACKEND_PROCESS = 'process'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_enabled():
+    """Return True if imports should run in the background."""
+    return BATCHIMPORT_JOB_BACKEND in (JOB_BACKEND_THREAD, JOB_BACKEND_PROCESS)
+
+
+def submit_import_job(file_name, model_for_import, import_options, import_info):
+    """
+    Record an import job and queue it for execution by the worker pool.
+
+    **Required arguments**
+
+    ``file_name``
+        Name of the uploaded file, in BATCHIMPORT_TEMPDIR. The file is removed
+        once the import has run.
+
+    ``model_for_import``
+        Name of the model (or relationship) for import, as chosen in the
+        upload form.
+
+    ``import_options``
+        Dictionary of process options (see ImportOptionsForm).
+
+    ``import_info``
+        The ModelImportInfo built from the options form.
+
+    **Returns**
+
+    ``job``
+        The new ImportJob.
+
+    """
+    job = ImportJob(file_name=file_name, model_for_import=model_for_import)
+    job.set_options(import_options)
+    job.set_import_info(import_info)
+    job.save()
+    _get_pool().apply_async(run_import_job, (job.pk,))
+    return job
+
+
+def resume_import_job(job):
+    """
+    Queue the ImportJob ``job`` for execution by the worker pool again, to
+    be resumed from its last checkpoint, if it can be resumed (see
+    ImportJob.is_resumable). Return True if the job was queued.
+
+    The job is claimed by a single conditional UPDATE, so that it is only
+    queued once even if it is resumed by several requests at the same time.
+
+    """
+    if not job.is_resumable:
+        return False
+    claimed_count = ImportJob.objects.filter(ImportJob.get_resumable_q(), pk=job.pk) \
+                                     .update(status=ImportJob.STATUS_PENDING, finished=None)
+    if not claimed_count:
+        return False
+    _get_pool().apply_async(run_import_job, (job.pk, True))
+    return True
+
+
+def run_import_job(job_id, resume=False):
+    """
+    Run the import of the ImportJob whose primary key is ``job_id``, and
+    record its results. This is what the workers execute, but it can also
+    be called directly to run a job synchronously. If ``resume`` is True,
+    the import is resumed from its checkpoint, if it has one.
+
+    The uploaded file is removed once the import has gone through, and kept
+    if it was interrupted, so that it can be resumed.
+
+    """
+    try:
+        job = ImportJob.objects.get(pk=job_id)
+        filepath = join(BATCHIMPORT_TEMPDIR, job.file_name)
+        try:
+            _run_import_job(job, filepath, resume)
+        except Exception, e:
+            # Something went wrong outside of the import itself (unreadable
+            # options or checkpoint, unwritable result log, ...): the job
+            # would otherwise stay running forever.
+            _fail_import_job(job, filepath, e)
+    finally:
+        # Workers are long-lived, don't keep their connections open between
+        # jobs.
+        for connection in connections.all():
+            connection.close()
+
+
+def _run_import_job(job, filepath, resume):
+    job.status = ImportJob.STATUS_RUNNING
+    job.started = timezone.now()
+    job.heartbeat = job.started
+    job.save()
+
+    import_options = job.get_options()
+    status_dict = _init_status_dict(import_options, job.get_import_id(), resume)
+    progress = JobProgress(job, start_count=status_dict['processed_count'])
+    try:
+        status_dict = _do_import(None,
+                                 job.get_import_info(),
+                                 filepath,
+                                 import_options,
+                                 status_dict,
+                                 progress)
+        job.status = ImportJob.STATUS_DONE
+    except Exception, e:
+        _report_import_error(filepath, e, status_dict)
+        job.status = ImportJob.STATUS_FAILED
+    progress.finish(status_dict)
+    status_dict['result_log'].close()
+
+    job.update_from_status_dict(status_dict)
+    job.finished = timezone.now()
+    job.save()
+
+    if not status_dict['interrupted']:
+        try:
+            os.remove(filepath)
+        except:
+            pass
+
+
+def _fail_import_job(job, filepath, e):
+    # The job instance may be the reason of the failure, update the row
+    # directly. The file is kept, so that the job can be resumed.
+    status_dict = {'error_count': 0,
+                   'error_messages': [],
+                   'interrupted': False}
+    _report_import_error(filepath, e, status_dict)
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=ImportJob.STATUS_FAILED,
+        finished=timezone.now(),
+        error_count=(job.error_count or 0) + status_dict['error_count'],
+        error_messages=json.dumps(status_dict['error_messages']))
+
+
+class JobProgress(ImportProgress):
+    """
+    Progress of an import run as a job: on top of being published, the
+    progress is recorded as the heartbeat of the job, at most every tenth
+    of BATCHIMPORT_JOB_LEASE.
+
+    """
+    def __init__(self, job, **kwargs):
+        super(JobProgress, self).__init__(job.get_import_id(), **kwargs)
+        self.job_id = job.pk
+        self.heartbeat_interval = BATCHIMPORT_JOB_LEASE / 10.0
+        self._last_heartbeat_time = self.start_time
+
+    def publish(self, status_dict, now=None, finished=False):
+        now = now or time.time()
+        super(JobProgress, self).publish(status_dict, now, finished)
+        if now - self._last_heartbeat_time >= self.heartbeat_interval:
+            self._last_heartbeat_time = now
+            ImportJob.objects.filter(pk=self.job_id, status=ImportJob.STATUS_RUNNING) \
+                             .update(heartbeat=timezone.now())
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if BATCHIMPORT_JOB_BACKEND == JOB_BACKEND_PROCESS:
+                # The worker processes are forked when the pool is created,
+                # they must not share the database connections of the web
+                # process.
+                for connection in connections.all():
+                    connection.close()
+                _pool = Pool(BATCHIMPORT_JOB_WORKERS)
+            else:
+                _pool = ThreadPool(BATCHIMPORT_JOB_WORKERS)
+        return _pool
@@ -0,0 +1,184 @@
+"""
+Management command running an import from the command line, without going
+through the upload and options views (for large files loaded from cron, for
+example).
+
+The column mapping is given as an import plan, the JSON file the options
+view stores in BATCHIMPORT_TEMPDIR (see batchimport.plans), so a mapping
+set up once in the web flow can be reused as is. The related model of the
+mapped related fields can be left out of hand written plans, it is then
+taken from the model fields.
+
+"""
+# This module is named after the package, make sure the imports below
+# don't import it again.
+from __future__ import absolute_import
+
+import hashlib
+import json
+import sys
+import time
+from optparse import make_option
+from os.path import abspath, isfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+
+from batchimport.batchimport_settings import *
+from batchimport.parser import _init_status_dict, _do_import, _report_import_error
+from batchimport.progress import ImportProgress
+from batchimport.utils import ModelImportInfo
+
+
+class Command(BaseCommand):
+    args = '<file> <model> <plan>'
+    help = ("Import the spreadsheet <file> into <model> (a dotted model name, or a "
+            "relation as '<model>%relation<field>%<model>'), mapping its columns as "
+            "described by the JSON import plan <plan>.")
+    option_list = BaseCommand.option_list + (
+        make_option('--start-row', type='int', dest='start_row', default=BATCHIMPORT_START_ROW,
+                    help='First row to import, counting from 1 (default: %default).'),
+        make_option('--end-row', type='int', dest='end_row', default=BATCHIMPORT_END_ROW,
+                    help='Last row to import, -1 for the last row of the file (default: %default).'),
+        make_option('--update-dupes', action='store_true', dest='update_dupes',
+                    default=BATCHIMPORT_UPDATE_DUPS,
+                    help='Update the existing objects matching the identity fields.'),
+        make_option('--stop-on-first-error', action='store_true', dest='stop_on_first_error',
+                    default=BATCHIMPORT_STOP_ON_FIRST_ERROR,
+                    help='Stop the import at the first row that fails.'),
+        make_option('--validate-only', action='store_true', dest='validate_only',
+                    default=BATCHIMPORT_VALIDATE_ONLY,
+                    help='Only check the rows, without writing anything.'),
+        make_option('--bulk-create', action='store_true', dest='bulk_create',
+                    default=BATCHIMPORT_BULK_CREATE,
+                    help='Write new objects and changed fields in batches, without calling save() '
+                         '(otherwise each row is saved on its own).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=BATCHIMPORT_BATCH_SIZE,
+                    help='Number of rows processed per batch (default: %default).'),
+        make_option('--transaction-size', type='int', dest='transaction_size',
+                    default=BATCHIMPORT_TRANSACTION_SIZE,
+                    help='Number of rows committed together (default: %default).'),
+        make_option('--parallel-workers', type='int', dest='parallel_workers',
+                    default=BATCHIMPORT_PARALLEL_WORKERS,
+                    help='Number of processes importing the rows (default: %default).'),
+        make_option('--import-id', dest='import_id', default=None,
+                    help='Identifier of the import, naming its result log and checkpoints '
+                         '(default: derived from the file, model and plan).'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+                    help='Resume the import from its last checkpoint, if it has one.'),
+        make_option('--progress-interval', type='float', dest='progress_interval', default=10.0,
+                    help='Seconds between progress lines (default: %default).'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 3:
+            raise CommandError('Usage: manage.py batchimport %s' % self.args)
+        filepath, model_for_import, plan_path = args
+        if not isfile(filepath):
+            raise CommandError("File '%s' not found." % filepath)
+        try:
+            with open(plan_path, 'rb') as f:
+                plan_dict = json.load(f)
+        except (IOError, ValueError), e:
+            raise CommandError("Can't read the import plan '%s': %s" % (plan_path, e))
+        if plan_dict.get('model', model_for_import) != model_for_import:
+            raise CommandError("The import plan is for '%s', not '%s'." % (plan_dict['model'], model_for_import))
+        plan_dict['model'] = model_for_import
+        try:
+            plan_dict['relations'] = _get_relation_plan_dict(plan_dict)
+            model_import_info = ModelImportInfo.from_plan_dict(plan_dict)
+        except (KeyError, AttributeError, ValueError, IndexError), e:
+            raise CommandError("Invalid import plan '%s': %r" % (plan_path, e))
+
+        process_option_dict = {'show_successful_imports': False,
+                               'show_successful_updates': False}
+        for key in ('start_row', 'end_row', 'update_dupes', 'stop_on_first_error', 'validate_only',
+                    'bulk_create', 'batch_size', 'transaction_size', 'parallel_workers'):
+            process_option_dict[key] = options[key]
+        import_id = options['import_id'] or \
+                    'command-%s' % hashlib.sha1('\x00'.join([abspath(filepath), model_for_import,
+                                                             json.dumps(plan_dict, sort_keys=True)])).hexdigest()[:16]
+
+        status_dict = _init_status_dict(process_option_dict, import_id, options['resume'])
+        if status_dict['resumed_from_row'] is not None:
+            self.stdout.write('Resuming after row %d.' % status_dict['resumed_from_row'])
+        progress = CommandProgress(import_id, self.stdout, options['progress_interval'],
+                                   status_dict['processed_count'])
+        try:
+            status_dict = _do_import(None, model_import_info, filepath, process_option_dict,
+                                     status_dict, progress)
+        except Exception, e:
+            _report_import_error(filepath, e, status_dict)
+        progress.finish(status_dict)
+        status_dict['result_log'].close()
+
+        self.write_summary(model_for_import, status_dict, progress)
+        if status_dict['interrupted']:
+            raise CommandError("The import was interrupted, run the command again with --resume "
+                               "(and --import-id %s) to resume it." % import_id)
+
+    def write_summary(self, model_for_import, status_dict, progress):
+        elapsed_seconds = time.time() - progress.start_time
+        self.stdout.write('%s of %s: %s' % ('Validation' if status_dict['validate_only'] else 'Import',
+                                            model_for_import,
+                                            'interrupted' if status_dict['interrupted'] else 'done'))
+        self.stdout.write('Rows processed: %d' % status_dict['processed_count'])
+        self.stdout.write('Rows imported: %d' % status_dict['imported_count'])
+        self.stdout.write('Rows updated: %d' % status_dict['updated_count'])
+        self.stdout.write('Rows unchanged: %d' % status_dict['unchanged_count'])
+        self.stdout.write('Errors: %d' % status_dict['error_count'])
+        rows_per_second = None
+        if elapsed_seconds > 0:
+            rows_per_second = (status_dict['processed_count'] - progress.start_count) / elapsed_seconds
+        self.stdout.write('Time: %.1fs (%s rows/s)' % (elapsed_seconds, _format_rate(rows_per_second)))
+        for error_message in status_dict['error_messages']:
+            self.stdout.write('Row %s: %s' % (error_message.get('row', '-'), error_message['description']))
+        if status_dict['error_count'] > len(status_dict['error_messages']):
+            self.stdout.write('(only the first %d errors are listed)' % len(status_dict['error_messages']))
+        self.stdout.write('Result log: %s' % status_dict['result_log'].path)
+
+
+class CommandProgress(ImportProgress):
+    """
+    Progress of an import run by the command: on top of being published to
+    the cache, the progress is written to ``stream`` as a line every
+    ``every_seconds`` seconds.
+
+    """
+    def __init__(self, import_id, stream, every_seconds, start_count=0):
+        super(CommandProgress, self).__init__(import_id, every_rows=sys.maxint,
+                                              every_seconds=every_seconds, start_count=start_count)
+        self.stream = stream
+
+    def publish(self, status_dict, now=None, finished=False):
+        super(CommandProgress, self).publish(status_dict, now, finished)
+        if finished:
+            return
+        progress_dict = self.get_progress_dict(status_dict, now or time.time())
+        line = '%d rows processed' % progress_dict['processed_count']
+        if progress_dict['total_count']:
+            line += '/%d' % progress_dict['total_count']
+        line += ', %s rows/s, %d errors' % (_format_rate(progress_dict['rows_per_second']),
+                                            progress_dict['error_count'])
+        if progress_dict['eta_seconds'] is not None:
+            line += ', %ds left' % progress_dict['eta_seconds']
+        self.stream.write(line)
+
+
+def _get_relation_plan_dict(plan_dict):
+    # Fill in the related model of the mapped related fields whose plan
+    # doesn't give it.
+    relation_plan_dict = dict(plan_dict.get('relations', {}))
+    for full_field_name, field_plan in plan_dict['fields'].items():
+        if field_plan.get('mapping') and not full_field_name in relation_plan_dict:
+            full_model_name, field_name = full_field_name.rsplit('.', 1)
+            model = get_model(full_model_name.split('.')[0], full_model_name.split('.')[-1])
+            related_model = model._meta.get_field_by_name(field_name.rstrip('*'))[0].rel.to
+            relation_plan_dict[full_field_name] = [related_model._meta.app_label, related_model.__name__]
+    return relation_plan_dict
+
+
+def _format_rate(rows_per_second):
+    if rows_per_second is None:
+        return '-'
+    return '%.0f' % rows_per_second
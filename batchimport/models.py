@@ -0,0 +1,135 @@
+"""
+Models used to keep track of the imports that run in the background
+(see batchimport.jobs).
+
+"""
+import json
+from datetime import timedelta
+from os.path import isfile, join
+
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+from batchimport.batchimport_settings import *
+from batchimport.utils import ModelImportInfo
+
+
+class ImportJob(models.Model):
+    """
+    An import run in the background. The job holds everything needed to run
+    the import (the uploaded file name, the import options and the import
+    plan of the ModelImportInfo built from the options form, as JSON), and
+    the results of the import once it has run.
+
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = ((STATUS_PENDING, 'Pending'),
+                      (STATUS_RUNNING, 'Running'),
+                      (STATUS_DONE, 'Done'),
+                      (STATUS_FAILED, 'Failed'))
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    file_name = models.CharField(max_length=255)
+    model_for_import = models.CharField(max_length=255)
+    options = models.TextField()
+    import_info = models.TextField()
+
+    row_count = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)
+    imported_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    unchanged_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    error_messages = models.TextField(blank=True)
+
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Last time the worker running the job reported progress (see
+    # BATCHIMPORT_JOB_LEASE).
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __unicode__(self):
+        return u'%s import of %s (%s)' % (self.model_for_import, self.file_name, self.status)
+
+    def get_import_id(self):
+        """Identifier of the import, used to publish its progress (see
+        batchimport.progress)."""
+        return 'job-%d' % self.pk
+
+    def get_options(self):
+        return json.loads(self.options)
+
+    def set_options(self, import_options):
+        self.options = json.dumps(import_options)
+
+    def get_import_info(self):
+        return ModelImportInfo.from_plan_dict(json.loads(self.import_info))
+
+    def set_import_info(self, import_info):
+        self.import_info = json.dumps(import_info.get_plan_dict())
+
+    def get_error_messages(self):
+        if not self.error_messages:
+            return []
+        return json.loads(self.error_messages)
+
+    def update_from_status_dict(self, status_dict):
+        """Copy the counters and error messages (only the sample kept in
+        the dictionary, see batchimport.results) of an import status
+        dictionary (see batchimport.parser) to the job."""
+        self.row_count = status_dict['row_count']
+        self.processed_count = status_dict['processed_count']
+        self.imported_count = status_dict['imported_count']
+        self.updated_count = status_dict['updated_count']
+        self.unchanged_count = status_dict['unchanged_count']
+        self.error_count = status_dict['error_count']
+        self.error_messages = json.dumps(status_dict['error_messages'])
+
+    @property
+    def validate_only(self):
+        return bool(self.get_options().get('validate_only'))
+
+    @property
+    def is_finished(self):
+        return self.status in (ImportJob.STATUS_DONE, ImportJob.STATUS_FAILED)
+
+    @property
+    def is_stalled(self):
+        """True if the job is running but its worker hasn't reported any
+        progress for BATCHIMPORT_JOB_LEASE seconds (it most likely died)."""
+        last_seen = self.heartbeat or self.started
+        return self.status == ImportJob.STATUS_RUNNING and last_seen is not None and \
+               last_seen < timezone.now() - timedelta(seconds=BATCHIMPORT_JOB_LEASE)
+
+    @property
+    def is_resumable(self):
+        """True if the import didn't go through (it failed, or it is
+        stalled) and can be resumed from its checkpoint, its file being
+        still there."""
+        return (self.status == ImportJob.STATUS_FAILED or self.is_stalled) and \
+               isfile(join(BATCHIMPORT_TEMPDIR, self.file_name))
+
+    @staticmethod
+    def get_resumable_q():
+        """Return the Q object selecting the jobs that failed or are
+        stalled (see ``is_stalled``)."""
+        expired = timezone.now() - timedelta(seconds=BATCHIMPORT_JOB_LEASE)
+        return Q(status=ImportJob.STATUS_FAILED) | \
+               Q(status=ImportJob.STATUS_RUNNING, heartbeat__lt=expired) | \
+               Q(status=ImportJob.STATUS_RUNNING, heartbeat__isnull=True, started__lt=expired)
+
+    @property
+    def duration(self):
+        """Time spent running the import so far, as a timedelta (or None if
+        the job hasn't started yet)."""
+        if self.started is None:
+            return None
+        return (self.finished or timezone.now()) - self.started
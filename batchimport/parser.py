@@ -1,11 +1,328 @@
 import sys
+from collections import OrderedDict
+from itertools import islice
+from multiprocessing import Pool, TimeoutError, current_process
 from os.path import join, isfile
 
 from django.core.urlresolvers import reverse
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError, NON_FIELD_ERRORS
+from django.db import connections, models, router, transaction
+from django.db.models import Q
+from django.db.models.fields import AutoField, FieldDoesNotExist
 
+from batchimport.batchimport_settings import *
+from batchimport.checkpoints import CHECKPOINT_COUNTER_KEYS, save_checkpoint, load_checkpoint, delete_checkpoint
+from batchimport.progress import ImportProgress, get_progress, delete_progress
+from batchimport.readers import get_reader, ShardReader
+from batchimport.results import ImportResultLog, RESULT_IMPORT, RESULT_UPDATE, RESULT_UNCHANGED, RESULT_ERROR
+from batchimport.utils import ModelImportInfo
 
-def _do_batch_import(request, model_import_info, book, sheet, process_option_dict, status_dict):
+
+def _init_status_dict(process_option_dict, import_id=None, resume=False):
+    """
+    Return a new status information dictionary, used to keep track of the
+    results of an import run with the given options.
+
+    Only the first BATCHIMPORT_RESULT_SAMPLE_SIZE messages of each kind are
+    kept in the dictionary. If ``import_id`` is given, every message is also
+    written to the (emptied) result log of that import (see
+    batchimport.results), under the 'result_log' key, and checkpoints of the
+    import are recorded as its rows get committed (see
+    batchimport.checkpoints).
+
+    If ``resume`` is True and the import has a checkpoint, the import is
+    resumed from there instead: the counters and the result log are those
+    of the checkpoint, and the import functions start with the row following
+    it (the 'resumed_from_row' key).
+
+    """
+    status_dict = {}
+    status_dict['import_id'] = import_id
+    status_dict['resume'] = resume
+    status_dict['resumed_from_row'] = None
+    status_dict['interrupted'] = False
+
+    status_dict['start_row'] = process_option_dict['start_row']
+    status_dict['end_row'] = process_option_dict['end_row']
+    status_dict['validate_only'] = process_option_dict.get('validate_only', False)
+
+    status_dict['row_count'] = 0
+    status_dict['processed_count'] = 0
+
+    status_dict['imported_count'] = 0
+    status_dict['updated_count'] = 0
+    status_dict['unchanged_count'] = 0
+    status_dict['error_count'] = 0
+
+    status_dict['related_cache_hits'] = 0
+    status_dict['related_cache_misses'] = 0
+    status_dict['override_stats'] = []
+
+    status_dict['combined_messages'] = []
+    status_dict['import_messages'] = []
+    status_dict['update_messages'] = []
+    status_dict['error_messages'] = []
+
+    status_dict['result_log'] = None
+    if import_id is not None:
+        status_dict['result_log'] = ImportResultLog(import_id)
+        checkpoint_dict = load_checkpoint(import_id) if resume else None
+        if checkpoint_dict is not None:
+            _restore_checkpoint(status_dict, checkpoint_dict, process_option_dict)
+        else:
+            delete_checkpoint(import_id)
+            status_dict['result_log'].clear()
+
+    return status_dict
+
+
+def _restore_checkpoint(status_dict, checkpoint_dict, process_option_dict):
+    """
+    Set up ``status_dict`` to resume an import from ``checkpoint_dict``: the
+    counters are restored, the result log is truncated back to the
+    checkpoint, and the message samples are read back from it.
+
+    """
+    for key in CHECKPOINT_COUNTER_KEYS:
+        status_dict[key] = checkpoint_dict[key]
+    status_dict['resumed_from_row'] = checkpoint_dict['row']
+    result_log = status_dict['result_log']
+    result_log.truncate(checkpoint_dict['result_log_size'])
+
+    list_names_by_kind = {RESULT_IMPORT: ['import_messages'],
+                          RESULT_UPDATE: ['update_messages'],
+                          RESULT_ERROR: ['error_messages']}
+    if process_option_dict['show_successful_imports']:
+        list_names_by_kind[RESULT_IMPORT].append('combined_messages')
+    if process_option_dict['show_successful_updates']:
+        list_names_by_kind[RESULT_UPDATE].append('combined_messages')
+    for status_msg in result_log.iter_messages(list_names_by_kind.keys()):
+        for key in list_names_by_kind[status_msg.pop('kind')]:
+            _append_message_sample(status_dict, key, status_msg)
+        if all([len(status_dict[key]) >= BATCHIMPORT_RESULT_SAMPLE_SIZE
+                for key in ('combined_messages', 'import_messages', 'update_messages', 'error_messages')]):
+            break
+
+
+def _save_checkpoint(status_dict, row):
+    """Record a checkpoint (see batchimport.checkpoints) of the import
+    whose status dictionary is ``status_dict``, once the rows up to ``row``
+    (counting from 1) are committed."""
+    if status_dict.get('import_id') is None:
+        return
+    checkpoint_dict = dict([(key, status_dict[key]) for key in CHECKPOINT_COUNTER_KEYS])
+    checkpoint_dict['row'] = row
+    checkpoint_dict['result_log_size'] = status_dict['result_log'].sync()
+    save_checkpoint(status_dict['import_id'], checkpoint_dict)
+
+
+def _get_first_row_index(process_option_dict, status_dict):
+    """Return the index (counting from 0) of the first row to import: the
+    start row of the options, or the row following the checkpoint the import
+    is resumed from."""
+    first_row_index = process_option_dict['start_row'] - 1
+    if status_dict.get('resumed_from_row') is not None:
+        first_row_index = max(first_row_index, status_dict['resumed_from_row'])
+    return first_row_index
+
+
+def _get_end_row_index(process_option_dict):
+    """Return the index (counting from 0) of the row following the last row
+    to import, or None to import up to the last row of the spreadsheet."""
+    if process_option_dict['end_row'] == -1:
+        return None
+    return process_option_dict['end_row']
+
+
+def _set_row_count(row_count, process_option_dict, status_dict):
+    """Record the number of rows of the spreadsheet, if known, and make it
+    the end row of an import running up to the last row."""
+    if row_count is None:
+        return
+    status_dict['row_count'] = row_count
+    if process_option_dict['end_row'] == -1:
+        process_option_dict['end_row'] = row_count
+        status_dict['end_row'] = row_count
+
+
+def _do_import(request, model_import_info, filepath, process_option_dict, status_dict, progress=None):
+    """
+    Open the spreadsheet whose path is ``filepath`` and run either the object
+    import or the relationship import, depending on the import mode of
+    ``model_import_info``. See ``_do_batch_import`` for the arguments.
+
+    If the options say to process the spreadsheet up to the last row
+    (``end_row`` is -1), ``end_row`` is set to the actual last row in both
+    ``process_option_dict`` and ``status_dict``. The rows of CSV files are
+    only counted if the import reads them up to the end of the file (the
+    'row_count' key stays 0 otherwise), as counting them beforehand would
+    take a pass over the file of its own.
+
+    Once the import has gone through, its checkpoint is deleted. It is kept
+    if the import raises an exception or reports an import error (the
+    'interrupted' key of ``status_dict``), so that it can be resumed.
+
+    """
+    with get_reader(filepath) as reader:
+        # Determine the last row of the spreadsheet to be processed, if it
+        # can be known before reading the rows.
+        _set_row_count(reader.get_counted_nrows(), process_option_dict, status_dict)
+
+        if model_import_info.import_mode == ModelImportInfo.OBJECT_IMPORT:
+            # Daemonic processes (such as the workers of the 'process' job
+            # backend) can't start processes of their own.
+            if (process_option_dict.get('parallel_workers') or 1) > 1 and not current_process().daemon:
+                status_dict = _do_parallel_import(model_import_info, filepath,
+                                                  process_option_dict, status_dict, progress)
+            else:
+                status_dict = _do_batch_import(request, model_import_info, reader,
+                                               process_option_dict, status_dict, progress)
+        else:
+            status_dict = _do_relation_import(request, model_import_info, reader,
+                                              process_option_dict, status_dict, progress)
+        # Otherwise the rows have been counted as they were read (by the
+        # worker processes for parallel imports).
+        _set_row_count(status_dict['row_count'] or reader.get_counted_nrows(), process_option_dict, status_dict)
+    if status_dict['import_id'] is not None and not status_dict['interrupted']:
+        delete_checkpoint(status_dict['import_id'])
+    return status_dict
+
+
+def _do_parallel_import(model_import_info, filepath, process_option_dict, status_dict, progress=None):
+    """
+    Run the object import using a pool of ``parallel_workers`` processes
+    (see the process options), each process importing one shard of the rows
+    with its own reader and database connection. The shards are made by
+    hashing the identity columns of each row (see ShardReader), so that two
+    processes never import the same object, and the status dictionaries of
+    the shards are merged into ``status_dict`` as the shards finish.
+
+    While they run, the shards publish their own progress (under the
+    '<import id>-shard<index>' import ids, see batchimport.progress), which
+    is summed up and published as the progress of the whole import. This
+    needs a cache shared between processes.
+
+    Note that the ``request`` isn't available to value override functions
+    in the worker processes (they get None instead), and that the
+    ``stop_on_first_error`` option applies to each shard separately.
+
+    Each shard has its own checkpoints and result log, and the result logs
+    are only merged once every shard is done, so that an interrupted import
+    can be resumed shard by shard.
+
+    """
+    shard_count = process_option_dict['parallel_workers']
+    import_id = status_dict['import_id']
+    progress_id = progress and progress.import_id
+    shard_args_list = [(model_import_info, filepath, process_option_dict, shard_index, shard_count,
+                        import_id and '%s-shard%d' % (import_id, shard_index), status_dict['resume'],
+                        progress_id and '%s-shard%d' % (progress_id, shard_index))
+                       for shard_index in range(shard_count)]
+
+    # The worker processes are forked when the pool is created, they must
+    # not share the database connections of this process.
+    for connection in connections.all():
+        connection.close()
+    pool = Pool(shard_count)
+    shard_status_dict_by_index = {}
+    try:
+        shard_iter = pool.imap_unordered(_do_shard_import, shard_args_list)
+        while len(shard_status_dict_by_index) < shard_count:
+            try:
+                shard_index, shard_status_dict = shard_iter.next(progress and progress.every_seconds)
+            except TimeoutError:
+                progress.publish(_get_running_status_dict(status_dict, shard_args_list,
+                                                          shard_status_dict_by_index))
+                continue
+            _merge_status_dict(status_dict, shard_status_dict)
+            shard_status_dict_by_index[shard_index] = shard_status_dict
+            if progress is not None:
+                progress.update(_get_running_status_dict(status_dict, shard_args_list,
+                                                         shard_status_dict_by_index))
+    finally:
+        pool.close()
+        pool.join()
+        for shard_args in shard_args_list:
+            if shard_args[-1] is not None:
+                delete_progress(shard_args[-1])
+
+    # The logs (and checkpoints) of the shards are kept if the import is to
+    # be resumed.
+    for shard_index in sorted(shard_status_dict_by_index):
+        shard_status_dict = shard_status_dict_by_index[shard_index]
+        if status_dict['result_log'] is not None and shard_status_dict['result_log'] is not None:
+            status_dict['result_log'].extend(shard_status_dict['result_log'],
+                                             delete=not status_dict['interrupted'])
+        if shard_status_dict['import_id'] is not None and not status_dict['interrupted']:
+            delete_checkpoint(shard_status_dict['import_id'])
+    return status_dict
+
+
+def _get_running_status_dict(status_dict, shard_args_list, shard_status_dict_by_index):
+    # Counters of the finished shards (already merged into ``status_dict``)
+    # plus the last ones published by the running shards.
+    running_status_dict = dict(status_dict)
+    for shard_args in shard_args_list:
+        if shard_args[3] in shard_status_dict_by_index or shard_args[-1] is None:
+            continue
+        shard_progress_dict = get_progress(shard_args[-1])
+        if shard_progress_dict is not None:
+            for key in ('processed_count', 'imported_count', 'updated_count', 'unchanged_count', 'error_count'):
+                running_status_dict[key] += shard_progress_dict[key]
+    return running_status_dict
+
+
+def _do_shard_import(shard_args):
+    """
+    Import one shard of the rows, in a worker process of
+    ``_do_parallel_import``, publishing its progress under its own progress
+    id if it has one, and return its index and status dictionary.
+
+    """
+    model_import_info, filepath, process_option_dict, shard_index, shard_count, shard_import_id, resume, \
+        shard_progress_id = shard_args
+    status_dict = _init_status_dict(process_option_dict, shard_import_id, resume)
+    progress = None
+    if shard_progress_id is not None:
+        progress = ImportProgress(shard_progress_id, start_count=status_dict['processed_count'])
+    try:
+        with get_reader(filepath) as reader:
+            shard_reader = ShardReader(reader,
+                                       model_import_info.get_identity_column_index_list(),
+                                       shard_index,
+                                       shard_count)
+            status_dict = _do_batch_import(None, model_import_info, shard_reader,
+                                           process_option_dict, status_dict, progress)
+            status_dict['row_count'] = shard_reader.get_counted_nrows() or 0
+    except Exception, e:
+        _report_import_error(filepath, e, status_dict)
+    finally:
+        for connection in connections.all():
+            connection.close()
+        if status_dict['result_log'] is not None:
+            status_dict['result_log'].close()
+    return shard_index, status_dict
+
+
+def _merge_status_dict(status_dict, shard_status_dict):
+    for key in ('processed_count', 'imported_count', 'updated_count', 'unchanged_count', 'error_count',
+                'related_cache_hits', 'related_cache_misses'):
+        status_dict[key] += shard_status_dict[key]
+    for key in ('combined_messages', 'import_messages', 'update_messages', 'error_messages'):
+        status_dict[key].extend(shard_status_dict[key][:max(BATCHIMPORT_RESULT_SAMPLE_SIZE - len(status_dict[key]), 0)])
+    status_dict['interrupted'] = status_dict['interrupted'] or shard_status_dict['interrupted']
+    status_dict['row_count'] = status_dict['row_count'] or shard_status_dict['row_count']
+    override_stats_dict = dict([(stats_dict['name'], stats_dict) for stats_dict in status_dict['override_stats']])
+    for shard_stats_dict in shard_status_dict['override_stats']:
+        stats_dict = override_stats_dict.get(shard_stats_dict['name'])
+        if stats_dict is None:
+            status_dict['override_stats'].append(dict(shard_stats_dict))
+        else:
+            for key in ('calls', 'cache_hits', 'seconds'):
+                stats_dict[key] += shard_stats_dict[key]
+
+
+def _do_batch_import(request, model_import_info, reader, process_option_dict, status_dict, progress=None):
     """
 	This function actually processes the incoming spreadsheet for object
 	import. While it can handle relationships, especially simple foreign
@@ -18,21 +335,35 @@ def _do_batch_import(request, model_import_info, book, sheet, process_option_dic
 	row represents an object already in the database. If so, it updates
 	that object (if the settings say to do so. If not, then it creates it.  
 	
+	Rows are handled in batches (see BATCHIMPORT_BATCH_SIZE): the existing
+	objects for all the rows of a batch are fetched with a single query,
+	so that deciding between update and insert doesn't cost a query per row.
+	Batches are committed together in chunks of BATCHIMPORT_TRANSACTION_SIZE
+	rows, and each row is written in a savepoint so that a failing row is
+	rolled back alone.
+	
+	If the ``validate_only`` option is set, nothing is written: the rows are
+	only checked, and reported as they would be by the import (see
+	``_validate_window``).
+	
+	A checkpoint is recorded after each chunk is committed, and the import
+	starts after the checkpoint it is resumed from, if any (see
+	``_init_status_dict``).
+	
     **Required arguments**
     
     ``request``
     	Current HTTP request. This is used in case your override function needs
-    	current session information.
+    	current session information. It is None for imports that run in the
+    	background (see batchimport.jobs).
     	
 	``model_import_info``
 		This is the ModelImportInfo class (from batchimport.util) that holds 
 		all the various mapping information for the models and their fields.
 		
-	``book``
-		Current Excel workbook being processed.
-		
-	``sheet``
-		The current worksheet in the workbook being processed.
+	``reader``
+		The reader (from batchimport.readers) giving access to the rows of
+		the spreadsheet being processed.
 		
 	``process_option_dict``
 		This is a dictionary specifying the various mechanics options for 
@@ -44,89 +375,959 @@ def _do_batch_import(request, model_import_info, book, sheet, process_option_dic
     
     **Optional arguments**
        
-    none.    
+    ``progress``
+    	An ImportProgress (from batchimport.progress) to which the progress of
+    	the import is reported as rows get processed.
     
     """
-    import_object_dict = {}
-    import_object_id_dict = {}
+    batch_size = process_option_dict.get('batch_size') or BATCHIMPORT_BATCH_SIZE
+    transaction_size = process_option_dict.get('transaction_size') or BATCHIMPORT_TRANSACTION_SIZE
+    using = router.db_for_write(model_import_info.model_for_import)
+    validate_only = process_option_dict.get('validate_only', False)
+    stop_import = False
+    end_of_file = False
+    model_import_info.reset_related_object_cache()
+    model_import_info.reset_value_override_stats()
 
-    for row in range(process_option_dict['start_row']-1,process_option_dict['end_row']):
-        status_dict['processed_count'] += 1
-        try:
-            row_value_list = []
-            for cell in sheet.row(row):
-                if cell.ctype == 3:
-                    date_tuple = xlrd.xldate_as_tuple(cell.value, book.datemode)
-                    cell_value = str(date_tuple[0]) + '-' + str(date_tuple[1])  + '-' + str(date_tuple[2])
+    # When validating, the field values of the objects that the rows
+    # validated so far would create (by identity key), the owners of the
+    # values of unique fields these rows use and, the other way round, the
+    # values used by each owner, so that later rows are checked against
+    # them.
+    validated_object_dict = {}
+    validated_unique_value_dict = {}
+    validated_owner_value_dict = {}
+
+    # Rows are read lazily from the reader, one window at a time, so that
+    # only the current window is held in memory. Several windows are
+    # committed together, in chunks of at least transaction_size rows.
+    row_iterator = reader.iter_rows(_get_first_row_index(process_option_dict, status_dict),
+                                    _get_end_row_index(process_option_dict))
+    while not (stop_import or end_of_file):
+        last_row = None
+        with transaction.atomic(using=using):
+            transaction_row_count = 0
+            while transaction_row_count < transaction_size:
+                read_row_list = list(islice(row_iterator, batch_size))
+                if not read_row_list:
+                    end_of_file = True
+                    break
+                transaction_row_count += len(read_row_list)
+                last_row = read_row_list[-1][0]
+                if validate_only:
+                    keep_going = _validate_window(request, model_import_info, read_row_list,
+                                                  process_option_dict, status_dict, validated_object_dict,
+                                                  validated_unique_value_dict, validated_owner_value_dict)
                 else:
-                    cell_value = cell.value
-                    row_value_list.append(cell_value)
+                    keep_going = _import_window(request, model_import_info, read_row_list,
+                                                process_option_dict, status_dict, using)
+                if not keep_going:
+                    stop_import = True
+                    break
+        if last_row is not None:
+            _save_checkpoint(status_dict, last_row + 1)
+        # Only once the rows are committed: the heartbeat of background jobs
+        # (see batchimport.jobs) is written to the database when publishing,
+        # and must be neither hidden from other connections by the
+        # transaction nor rolled back with it.
+        if progress is not None:
+            progress.update(status_dict)
+
+    status_dict['related_cache_hits'], status_dict['related_cache_misses'] = model_import_info.get_related_object_cache_stats()
+    status_dict['override_stats'] = model_import_info.get_value_override_stats()
+    return status_dict
+
+
+def _import_window(request, model_import_info, read_row_list, process_option_dict, status_dict, using):
+    """
+    Import a window of rows (a list of (row index, row value list) tuples)
+    for ``_do_batch_import``. The database writes of each row run in their
+    own savepoint, so that a row that fails is rolled back alone.
 
+    Returns False if the import should stop (i.e. an error occured and the
+    options say to stop on the first error), True otherwise.
+
+    """
+    bulk_create = process_option_dict.get('bulk_create', False)
+    model_for_import = model_import_info.model_for_import
+
+    # Map every row of the window to its object/identity dictionaries
+    # first, so that the related objects they use and the objects they
+    # represent can be looked up in the database all at once. Errors are
+    # kept and reported in row order below.
+    model_import_info.prefetch_related_objects([row_value_list for row, row_value_list in read_row_list])
+
+    mapped_row_list = []
+    for row, row_value_list in read_row_list:
+        try:
             import_object_dict, import_object_id_dict = model_import_info.get_import_object_dicts(request, row_value_list)
+            _check_lookup_values(model_for_import, import_object_id_dict)
+            mapped_row_list.append((row, import_object_dict, import_object_id_dict, None))
+        except Exception, e:
+            mapped_row_list.append((row, None, None, e))
 
-            try:
-                # See if the current row represents a dupe.
-                dupe_in_db = model_import_info.model_for_import.objects.get(**import_object_id_dict)
-                if process_option_dict['update_dupes']: 
-                    for key in import_object_dict.keys():
-                        setattr(dupe_in_db, key, import_object_dict[key])
-                    dupe_in_db.save()
+    existing_object_dict = _get_existing_object_dict(model_for_import,
+                                                     [mapped_row[2] for mapped_row in mapped_row_list
+                                                      if mapped_row[3] is None])
 
-                    status_msg = { 'description' : 'Updated row #%d'  % row,
-                                   'object' : dupe_in_db }
+    # In bulk mode, new objects are kept here (along with the row they
+    # come from) until the end of the window, and then written in one go.
+    # The pending objects are also indexed by identity: a later row
+    # representing one of them writes them first, so that it is seen as a
+    # dupe (or not, if the object couldn't be written), exactly as it would
+    # be if every row was saved on its own.
+    pending_object_list = []
+    pending_object_by_id_dict = {}
+    # Likewise, in bulk mode, updated objects are kept here along with the
+    # names of their changed fields, and written at the end of the window,
+    # or before a later row updates one of them again, so that each row's
+    # changes are written (and reported) on their own.
+    pending_update_list = []
+    pending_update_field_name_dict = {}
+    # Rows are reported at the end of the window, in row order, once the
+    # pending objects are written (as (row, report function, object or
+    # exception) tuples).
+    report_list = []
+    keep_going = True
 
-                    status_dict['updated_count'] += 1
-                    if process_option_dict['show_successful_updates']:
-                        status_dict['combined_messages'].append(status_msg)
-                    status_dict['update_messages'].append(status_msg)
+    for row, import_object_dict, import_object_id_dict, mapping_error in mapped_row_list:
+        status_dict['processed_count'] += 1
+        try:
+            if mapping_error is not None:
+                raise mapping_error
 
-            except ObjectDoesNotExist:
+            identity_key = _get_identity_key(model_for_import, import_object_id_dict)
+            if identity_key in pending_object_by_id_dict:
+                # The current row is a dupe of an object that is still
+                # waiting to be written.
+                keep_going = _flush_pending_objects(model_import_info, pending_object_list,
+                                                    process_option_dict, status_dict, report_list, using)
+                for pending_row, pending_object, pending_id_dict in pending_object_list:
+                    if pending_object.pk is not None:
+                        existing_object_dict[_get_identity_key(model_for_import, pending_id_dict)] = [pending_object]
+                pending_object_list = []
+                pending_object_by_id_dict = {}
+                if not keep_going:
+                    # The import stops before the current row.
+                    status_dict['processed_count'] -= 1
+                    break
+
+            # See if the current row represents a dupe.
+            dupe_in_db = _get_existing_object(model_for_import, existing_object_dict,
+                                              identity_key, import_object_id_dict)
+            if dupe_in_db is not None and dupe_in_db.pk in pending_update_field_name_dict:
+                # The object was already updated by an earlier row.
+                keep_going = _flush_pending_updates(model_import_info, pending_update_list,
+                                                    pending_update_field_name_dict,
+                                                    process_option_dict, status_dict, report_list, using)
+                pending_update_list = []
+                pending_update_field_name_dict = {}
+                if not keep_going:
+                    # The import stops before the current row.
+                    status_dict['processed_count'] -= 1
+                    break
+            if dupe_in_db is not None:
+                if process_option_dict['update_dupes']: 
+                    # Only the fields whose value actually changed are
+                    # written, and rows that don't change anything aren't
+                    # written at all.
+                    changed_field_name_list = _set_changed_fields(dupe_in_db, import_object_dict)
+                    if changed_field_name_list:
+                        # The object changes, its auto_now fields get the
+                        # current time as with a full save().
+                        changed_field_name_list.extend(_get_auto_now_field_name_list(model_for_import,
+                                                                                     changed_field_name_list))
+                    if not changed_field_name_list:
+                        report_list.append((row, _report_row_unchanged, dupe_in_db))
+                    elif bulk_create:
+                        pending_update_list.append((row, dupe_in_db))
+                        pending_update_field_name_dict.setdefault(dupe_in_db.pk, set()).update(changed_field_name_list)
+                    else:
+                        with transaction.atomic(using=using):
+                            dupe_in_db.save(update_fields=changed_field_name_list)
+                        report_list.append((row, _report_row_update, dupe_in_db))
+            else:
                 # The object doesn't exist. Go ahead and add it.
-                new_object = model_import_info.model_for_import(**import_object_dict)
-                new_object.save()
+                new_object = model_for_import(**import_object_dict)
+                if bulk_create and identity_key is not None:
+                    pending_object_list.append((row, new_object, import_object_id_dict))
+                    pending_object_by_id_dict[identity_key] = new_object
+                else:
+                    with transaction.atomic(using=using):
+                        new_object.save()
+                    if identity_key is not None:
+                        existing_object_dict[identity_key] = [new_object]
+                    report_list.append((row, _report_row_import, new_object))
+
+        except Exception, e:
+            report_list.append((row, _report_row_error, e))
+            if process_option_dict['stop_on_first_error']:
+                keep_going = False
+                break
+
+    if pending_object_list:
+        if not _flush_pending_objects(model_import_info, pending_object_list,
+                                      process_option_dict, status_dict, report_list, using):
+            keep_going = False
+    if pending_update_list:
+        if not _flush_pending_updates(model_import_info, pending_update_list, pending_update_field_name_dict,
+                                      process_option_dict, status_dict, report_list, using):
+            keep_going = False
+
+    report_list.sort(key=lambda report: report[0])
+    for row, report_row, report_value in report_list:
+        report_row(row, report_value, process_option_dict, status_dict)
+    return keep_going
+
+
+def _validate_window(request, model_import_info, read_row_list, process_option_dict, status_dict,
+                     validated_object_dict, validated_unique_value_dict, validated_owner_value_dict):
+    """
+    Validate a window of rows (a list of (row index, row value list) tuples)
+    for ``_do_batch_import``, without writing anything. Rows are mapped as
+    they would be for the import, and the objects they would create or
+    update are checked in memory (see ``_validate_object``). The only
+    queries are the ones looking up the related objects, the existing
+    objects and the values of unique fields, for the whole window at once.
+
+    Rows are reported as they would be by the import (imported, updated,
+    unchanged or failed), with one difference: values of related fields
+    that don't match any related object are reported as errors, while the
+    import would just leave these fields empty.
+
+    ``validated_object_dict``, ``validated_unique_value_dict`` and
+    ``validated_owner_value_dict`` are kept from one window to the next (see
+    ``_do_batch_import``), so that rows representing an object created by
+    an earlier row are seen as updates, and that values of unique fields
+    used by several rows are reported, unless the object using them changed
+    them in the meantime.
 
-                status_msg = { 'description' : 'Imported row #%d'  % row,
-                               'object' : new_object }
-                status_dict['imported_count'] += 1
-                if process_option_dict['show_successful_imports']:
-                    status_dict['combined_messages'].append(status_msg)
-                status_dict['import_messages'].append(status_msg)
+    Returns False if the validation should stop (i.e. an error occured and
+    the options say to stop on the first error), True otherwise.
+
+    """
+    model_for_import = model_import_info.model_for_import
+    model_import_info.prefetch_related_objects([row_value_list for row, row_value_list in read_row_list])
+
+    mapped_row_list = []
+    for row, row_value_list in read_row_list:
+        try:
+            import_object_dict, import_object_id_dict = model_import_info.get_import_object_dicts(request, row_value_list)
+            error_dict = {}
+            for field_name, value in model_import_info.get_unresolved_related_values(request, row_value_list):
+                related_model = model_for_import._meta.get_field(field_name).rel.to
+                error_dict[field_name] = [u'No %s matching "%s".' % (related_model._meta.object_name, value)]
+            if error_dict:
+                raise ValidationError(error_dict)
+            _check_lookup_values(model_for_import, import_object_id_dict)
+            mapped_row_list.append((row, import_object_dict, import_object_id_dict, None))
+        except Exception, e:
+            mapped_row_list.append((row, None, None, e))
+
+    valid_mapped_row_list = [mapped_row for mapped_row in mapped_row_list if mapped_row[3] is None]
+    existing_object_dict = _get_existing_object_dict(model_for_import,
+                                                     [mapped_row[2] for mapped_row in valid_mapped_row_list])
+    # Values of unique fields not found here (unique_together field sets
+    # whose values don't all come from the row, say) are looked up when the
+    # object using them is validated.
+    unique_value_key_list = []
+    for mapped_row in valid_mapped_row_list:
+        try:
+            unique_value_key_list.extend(_get_unique_value_key_list(model_for_import(**mapped_row[1])))
+        except Exception:
+            # The row fails below.
+            pass
+    unique_value_dict = _get_unique_value_dict(model_for_import, unique_value_key_list)
+
+    for row, import_object_dict, import_object_id_dict, mapping_error in mapped_row_list:
+        status_dict['processed_count'] += 1
+        try:
+            if mapping_error is not None:
+                raise mapping_error
+
+            identity_key = _get_identity_key(model_for_import, import_object_id_dict)
+            if identity_key is not None and identity_key in validated_object_dict:
+                # The current row is a dupe of an object created by an
+                # earlier row.
+                if process_option_dict['update_dupes']:
+                    validated_object = model_for_import(**validated_object_dict[identity_key])
+                    changed_field_name_list = _set_changed_fields(validated_object, import_object_dict)
+                    if not changed_field_name_list:
+                        _report_row_unchanged(row, validated_object, process_option_dict, status_dict)
+                    else:
+                        _validate_object(validated_object, changed_field_name_list, ('new', identity_key),
+                                         unique_value_dict, validated_unique_value_dict,
+                                         validated_owner_value_dict, False)
+                        validated_object_dict[identity_key].update(import_object_dict)
+                        _report_row_update(row, validated_object, process_option_dict, status_dict)
+                continue
+
+            dupe_in_db = _get_existing_object(model_for_import, existing_object_dict,
+                                              identity_key, import_object_id_dict)
+            if dupe_in_db is not None:
+                if process_option_dict['update_dupes']:
+                    if not dupe_in_db.pk in validated_owner_value_dict:
+                        # The values the object uses in the database, which
+                        # it releases if the row changes them.
+                        unique_value_key_list = _get_unique_value_key_list(dupe_in_db)
+                        for unique_value_key in unique_value_key_list:
+                            validated_unique_value_dict.setdefault(unique_value_key, dupe_in_db.pk)
+                        validated_owner_value_dict[dupe_in_db.pk] = set(unique_value_key_list)
+                    changed_field_name_list = _set_changed_fields(dupe_in_db, import_object_dict)
+                    if not changed_field_name_list:
+                        _report_row_unchanged(row, dupe_in_db, process_option_dict, status_dict)
+                    else:
+                        _validate_object(dupe_in_db, changed_field_name_list, dupe_in_db.pk,
+                                         unique_value_dict, validated_unique_value_dict,
+                                         validated_owner_value_dict, False)
+                        _report_row_update(row, dupe_in_db, process_option_dict, status_dict)
+            else:
+                new_object = model_for_import(**import_object_dict)
+                _validate_object(new_object, import_object_dict.keys(), ('new', identity_key or row),
+                                 unique_value_dict, validated_unique_value_dict,
+                                 validated_owner_value_dict, True)
+                if identity_key is not None:
+                    validated_object_dict[identity_key] = dict(import_object_dict)
+                _report_row_import(row, new_object, process_option_dict, status_dict)
 
         except Exception, e:
-            status_dict['error_messages'].append({'name' : 'Row processing error',
-                                                  'critical' : False if not process_option_dict['stop_on_first_error'] else True,
-                                                  'description' : str(sys.exc_info()[1]),
-                                                  'info' : ["Row : %s" % row,
-                                                            "Exception : %s" % str(type(e))]})
+            _report_row_error(row, e, process_option_dict, status_dict)
             if process_option_dict['stop_on_first_error']:
+                return False
+    return True
+
+
+def _validate_object(model_object, field_name_list, owner_key, unique_value_dict,
+                     validated_unique_value_dict, validated_owner_value_dict, is_new):
+    """
+    Check, in memory, the fields ``field_name_list`` of an object that a row
+    would create (if ``is_new``) or update, and raise ValidationError if they
+    are not valid:
+
+    - their values are cleaned, as by ``Model.clean_fields()`` (related
+      fields are left out, their values being objects found in the
+      database),
+    - values of unique fields (and ``unique_together`` field sets) must not
+      be used by another object, according to the rows validated so far
+      (``validated_unique_value_dict``, mapping the values to the key of
+      the object using them, or None once released) or else to the database
+      (``unique_value_dict``, see ``_get_unique_value_dict``),
+    - new objects must have a value for the fields that can't be null.
+
+    If the object is valid, its values are recorded as used by the object
+    (identified by ``owner_key``), and the values it used before (according
+    to ``validated_owner_value_dict``) and doesn't use anymore are released.
+
+    """
+    model = model_object.__class__
+    field_name_set = set(field_name_list)
+    error_dict = {}
+    try:
+        model_object.clean_fields(exclude=[field.name for field in model._meta.fields
+                                           if not field.name in field_name_set or field.rel])
+    except ValidationError, e:
+        error_dict = e.message_dict
+
+    unique_value_key_list = _get_unique_value_key_list(model_object)
+    for unique_value_key in unique_value_key_list:
+        field_name_tuple = tuple([field_name for field_name, value in unique_value_key])
+        # Values of the fields that don't change are already the object's.
+        if field_name_set.isdisjoint(field_name_tuple) or \
+           any([field_name in error_dict for field_name in field_name_tuple]):
+            continue
+        if unique_value_key in validated_unique_value_dict:
+            unique_owner_key = validated_unique_value_dict[unique_value_key]
+        else:
+            if not unique_value_key in unique_value_dict:
+                unique_value_dict.update(_get_unique_value_dict(model, [unique_value_key]))
+            unique_owner_key = unique_value_dict.get(unique_value_key)
+        if unique_owner_key is not None and not unique_owner_key == owner_key:
+            if len(field_name_tuple) == 1:
+                error_dict[field_name_tuple[0]] = [model_object.unique_error_message(model, field_name_tuple)]
+            else:
+                error_dict.setdefault(NON_FIELD_ERRORS, []).append(model_object.unique_error_message(model,
+                                                                                                     field_name_tuple))
+
+    if is_new:
+        for field in model._meta.fields:
+            if field.name in field_name_set or field.null or isinstance(field, AutoField) or \
+               getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                continue
+            if field.get_default() is None:
+                error_dict.setdefault(field.name, []).append(field.error_messages['null'])
+
+    if error_dict:
+        raise ValidationError(error_dict)
+    unique_value_key_set = set(unique_value_key_list)
+    for unique_value_key in validated_owner_value_dict.get(owner_key, ()):
+        if not unique_value_key in unique_value_key_set and \
+           validated_unique_value_dict.get(unique_value_key) == owner_key:
+            validated_unique_value_dict[unique_value_key] = None
+    for unique_value_key in unique_value_key_list:
+        validated_unique_value_dict[unique_value_key] = owner_key
+    validated_owner_value_dict[owner_key] = unique_value_key_set
+
+
+def _get_unique_value_key_list(model_object):
+    """
+    Return the keys (built as identity keys, see ``_get_identity_key``) of
+    the values that ``model_object`` uses for the unique fields and the
+    ``unique_together`` field sets of its model. Field sets holding a null
+    value are left out, as the database doesn't compare null values.
+
+    """
+    model = model_object.__class__
+    field_name_tuple_list = [(field.name,) for field in model._meta.fields
+                             if field.unique and not field.primary_key]
+    field_name_tuple_list.extend([tuple(field_name_tuple) for field_name_tuple in model._meta.unique_together])
+    unique_value_key_list = []
+    for field_name_tuple in field_name_tuple_list:
+        value_dict = {}
+        for field_name in field_name_tuple:
+            value = getattr(model_object, model._meta.get_field(field_name).attname)
+            if value is None:
                 break
-                    
-    return status_dict
+            value_dict[field_name] = value
+        else:
+            unique_value_key = _get_identity_key(model, value_dict)
+            try:
+                hash(unique_value_key)
+            except TypeError:
+                # Unhashable value, there's nothing to compare it with.
+                continue
+            unique_value_key_list.append(unique_value_key)
+    return unique_value_key_list
+
+
+def _get_unique_value_dict(model, unique_value_key_list):
+    """
+    Find which objects already in the database use the values of unique
+    fields (or ``unique_together`` field sets) given as keys in
+    ``unique_value_key_list`` (see ``_get_unique_value_key_list``), with one
+    query per field set (unless the database limits the number of query
+    parameters). Keys holding values that can't be looked up are left out.
+
+    **Returns**
+
+    ``unique_value_dict``
+        A dictionary mapping each key to the primary key of the object
+        using its values, or None if no object does.
+
+    """
+    unique_value_dict = {}
+    key_list_by_field_name_tuple = {}
+    for unique_value_key in unique_value_key_list:
+        if unique_value_key in unique_value_dict:
+            continue
+        try:
+            for field_name, value in unique_value_key:
+                _check_lookup_value(model._meta.get_field(field_name), value)
+        except (TypeError, ValueError, ValidationError):
+            # The row fails validation anyway (see _validate_object), and
+            # the value would fail the query.
+            continue
+        unique_value_dict[unique_value_key] = None
+        key_list_by_field_name_tuple.setdefault(tuple([field_name for field_name, value in unique_value_key]),
+                                                []).append(unique_value_key)
+
+    connection = connections[model.objects.db]
+    for field_name_tuple, key_list in key_list_by_field_name_tuple.items():
+        field_list = [model._meta.get_field(field_name) for field_name in field_name_tuple]
+        lookup_batch_size = max(connection.ops.bulk_batch_size(list(field_name_tuple), key_list), 1)
+        for index in range(0, len(key_list), lookup_batch_size):
+            lookup_key_list = key_list[index:index+lookup_batch_size]
+            if len(field_name_tuple) == 1:
+                query_set = model.objects.filter(**{str(field_name_tuple[0] + '__in'): [unique_value_key[0][1]
+                                                                                        for unique_value_key in lookup_key_list]})
+            else:
+                query = Q()
+                for unique_value_key in lookup_key_list:
+                    query |= Q(**dict([(str(field_name), value) for field_name, value in unique_value_key]))
+                query_set = model.objects.filter(query)
+            for value_list in query_set.values_list('pk', *[field.attname for field in field_list]):
+                unique_value_key = tuple([(field.name, _get_lookup_value(field, value))
+                                          for field, value in zip(field_list, value_list[1:])])
+                if unique_value_key in unique_value_dict:
+                    unique_value_dict[unique_value_key] = value_list[0]
+    return unique_value_dict
+
+
+def _check_lookup_values(model, import_object_id_dict):
+    """
+    Prepare the values of an identity dictionary for a database lookup, as
+    ``filter()`` would, so that a value which can't be looked up (say 'abc'
+    for an integer or foreign key field) raises for the row it comes from,
+    instead of failing the lookup of the whole batch (see
+    ``_get_existing_object_dict``).
+
+    """
+    for field_name, field_value in import_object_id_dict.items():
+        try:
+            field = model._meta.get_field(field_name, many_to_many=False)
+        except FieldDoesNotExist:
+            continue
+        _check_lookup_value(field, field_value)
+
+
+def _check_lookup_value(field, field_value):
+    if isinstance(field_value, models.Model):
+        return
+    if field.rel is not None:
+        # Related objects are looked up by the value of their target field.
+        field = field.rel.get_related_field()
+    field.get_prep_lookup('exact', field_value)
+
+
+def _get_existing_object_dict(model, import_object_id_dict_list):
+    """
+    Find the objects already in the database that match any of the identity
+    dictionaries in ``import_object_id_dict_list``, using as few queries as
+    possible (a single ``__in`` or ``Q(...) | Q(...)`` query unless the
+    database limits the number of query parameters).
+
+    **Returns**
+
+    ``existing_object_dict``
+        A dictionary whose keys are identity keys (see ``_get_identity_key``)
+        and whose values are lists of matching objects (there should only be
+        one, but nothing guarantees that the identity fields are unique).
+
+    """
+    identity_dict_by_key = {}
+    for import_object_id_dict in import_object_id_dict_list:
+        identity_key = _get_identity_key(model, import_object_id_dict)
+        if identity_key is not None:
+            identity_dict_by_key[identity_key] = import_object_id_dict
+
+    existing_object_dict = {}
+    if not identity_dict_by_key:
+        return existing_object_dict
+
+    # Rows may not all use the same identity fields (empty values are left
+    # out of the identity dictionary), so we keep track of each field set
+    # found in order to index the objects returned by the database.
+    identity_field_name_set_list = list(set([tuple(sorted(import_object_id_dict.keys()))
+                                             for import_object_id_dict in identity_dict_by_key.values()]))
+    field_name_list = sorted(set([field_name for field_name_set in identity_field_name_set_list
+                                  for field_name in field_name_set]))
+
+    identity_dict_list = identity_dict_by_key.values()
+    connection = connections[model.objects.db]
+    lookup_batch_size = max(connection.ops.bulk_batch_size(field_name_list, identity_dict_list), 1)
+    for index in range(0, len(identity_dict_list), lookup_batch_size):
+        lookup_dict_list = identity_dict_list[index:index+lookup_batch_size]
+        if len(identity_field_name_set_list) == 1 and len(field_name_list) == 1:
+            field_name = field_name_list[0]
+            query_set = model.objects.filter(**{str(field_name + '__in'): [lookup_dict[field_name]
+                                                                           for lookup_dict in lookup_dict_list]})
+        else:
+            query = Q(**lookup_dict_list[0])
+            for lookup_dict in lookup_dict_list[1:]:
+                query |= Q(**lookup_dict)
+            query_set = model.objects.filter(query)
+
+        for existing_object in query_set:
+            for field_name_set in identity_field_name_set_list:
+                identity_key = _get_identity_key(model, dict([(field_name, getattr(existing_object, model._meta.get_field(field_name).attname))
+                                                              for field_name in field_name_set]))
+                if identity_key in identity_dict_by_key:
+                    object_list = existing_object_dict.setdefault(identity_key, [])
+                    if not existing_object in object_list:
+                        object_list.append(existing_object)
+
+    return existing_object_dict
+
+
+def _get_existing_object(model, existing_object_dict, identity_key, import_object_id_dict):
+    """
+    Return the object already in the database that the identity dictionary
+    of a row represents, or None if there is none. This behaves like
+    ``model.objects.get()`` (raising ``MultipleObjectsReturned`` when the
+    identity is ambiguous) but uses the objects found by
+    ``_get_existing_object_dict`` instead of querying the database, unless
+    the identity can't be matched in memory.
+
+    """
+    if identity_key is None:
+        try:
+            return model.objects.get(**import_object_id_dict)
+        except ObjectDoesNotExist:
+            return None
+    object_list = existing_object_dict.get(identity_key, [])
+    if len(object_list) > 1:
+        raise model.MultipleObjectsReturned("get() returned more than one %s -- it returned %s!" % \
+                                            (model._meta.object_name, len(object_list)))
+    if object_list:
+        return object_list[0]
+    return None
+
+
+def _flush_pending_objects(model_import_info, pending_object_list, process_option_dict, status_dict, report_list,
+                           using):
+    """
+    Write the new objects collected by ``_import_window`` in bulk mode (as
+    (row, object, identity dictionary) tuples) using a single ``bulk_create``
+    call, and add each of them to ``report_list`` as imported. If the batch
+    can't be written (it is written in a savepoint, so nothing has been saved
+    in that case) every object is saved on its own instead, so that the
+    error can be reported against the row it actually comes from.
+
+    ``bulk_create`` doesn't set the primary keys of the objects, so they
+    are looked up by identity afterwards (using a single query, see
+    ``_get_existing_object_dict``), for the results to give the id of the
+    imported objects.
+
+    Returns False if the import should stop (i.e. an error occured and the
+    options say to stop on the first error), True otherwise. The rows after
+    the one that stopped the import are neither written nor reported, and
+    they are taken out of the processed rows count of ``status_dict``.
+
+    """
+    model = model_import_info.model_for_import
+    try:
+        with transaction.atomic(using=using):
+            model.objects.bulk_create([new_object for row, new_object, import_object_id_dict in pending_object_list])
+    except Exception:
+        for index, (row, new_object, import_object_id_dict) in enumerate(pending_object_list):
+            try:
+                with transaction.atomic(using=using):
+                    new_object.save()
+                report_list.append((row, _report_row_import, new_object))
+            except Exception, e:
+                report_list.append((row, _report_row_error, e))
+                if process_option_dict['stop_on_first_error']:
+                    status_dict['processed_count'] -= len(pending_object_list) - index - 1
+                    return False
+        return True
+
+    created_object_dict = _get_existing_object_dict(model, [import_object_id_dict
+                                                            for row, new_object, import_object_id_dict in pending_object_list
+                                                            if new_object.pk is None])
+    for row, new_object, import_object_id_dict in pending_object_list:
+        if new_object.pk is None:
+            object_list = created_object_dict.get(_get_identity_key(model, import_object_id_dict), [])
+            if len(object_list) == 1:
+                new_object.pk = object_list[0].pk
+        report_list.append((row, _report_row_import, new_object))
+    return True
+
+
+def _flush_pending_updates(model_import_info, pending_update_list, pending_update_field_name_dict,
+                           process_option_dict, status_dict, report_list, using):
+    """
+    Write the changed fields of the objects updated by ``_import_window`` in
+    bulk mode, and add each row to ``report_list`` as updated. As with
+    ``bulk_create``, this doesn't call ``save()``: the objects are written in
+    batches, with one ``UPDATE`` query per batch setting each changed column
+    to a ``CASE`` over the primary keys (see ``_bulk_update``). If that fails
+    (everything runs in a savepoint, so nothing has been written in that
+    case), each object is updated on its own instead so that the error can be
+    reported against the rows it comes from.
+
+    Returns False if the import should stop (i.e. an error occured and the
+    options say to stop on the first error), True otherwise. As with
+    ``_flush_pending_objects``, the rows that are left unwritten then are
+    taken out of the processed rows count of ``status_dict``.
+
+    """
+    model = model_import_info.model_for_import
+    row_list_by_pk = OrderedDict()
+    object_by_pk = {}
+    for row, updated_object in pending_update_list:
+        row_list_by_pk.setdefault(updated_object.pk, []).append(row)
+        object_by_pk[updated_object.pk] = updated_object
+
+    field_by_name = {}
+    value_dict_by_pk = OrderedDict()
+    for pk in row_list_by_pk.keys():
+        value_dict = {}
+        for field_name in pending_update_field_name_dict[pk]:
+            try:
+                field = field_by_name[field_name]
+            except KeyError:
+                field = field_by_name[field_name] = model._meta.get_field(field_name)
+            if getattr(field, 'auto_now', False):
+                # As save() would, set auto_now fields to the current time.
+                value_dict[field.name] = field.pre_save(object_by_pk[pk], False)
+            else:
+                value_dict[field.name] = getattr(object_by_pk[pk], field.attname)
+        value_dict_by_pk[pk] = value_dict
+
+    try:
+        with transaction.atomic(using=using):
+            _bulk_update(model, value_dict_by_pk, using)
+    except Exception:
+        pending_row_count = len(pending_update_list)
+        for pk, row_list in row_list_by_pk.items():
+            pending_row_count -= len(row_list)
+            try:
+                with transaction.atomic(using=using):
+                    model._default_manager.using(using).filter(pk=pk).update(**value_dict_by_pk[pk])
+            except Exception, e:
+                for row in row_list:
+                    report_list.append((row, _report_row_error, e))
+                if process_option_dict['stop_on_first_error']:
+                    status_dict['processed_count'] -= pending_row_count
+                    return False
+                continue
+            for row in row_list:
+                report_list.append((row, _report_row_update, object_by_pk[pk]))
+        return True
+
+    for row, updated_object in pending_update_list:
+        report_list.append((row, _report_row_update, updated_object))
+    return True
+
+
+def _bulk_update(model, value_dict_by_pk, using):
+    """
+    Write the field values of ``value_dict_by_pk`` (dictionaries of field
+    values, by primary key) to the rows of ``model``, using one query per
+    table and batch of objects::
+
+        UPDATE table SET col = CASE pk WHEN %s THEN %s ... ELSE col END, ...
+        WHERE pk IN (...)
+
+    Each column only gets a ``WHEN`` clause for the objects that change it.
+    Batches are sized so that the queries hold at most as many parameters as
+    the database allows (see ``bulk_batch_size``).
+
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    # Fields inherited from a parent model live in the table of the parent,
+    # whose primary key holds the same values.
+    field_list_by_model = OrderedDict()
+    field_name_set = set()
+    for value_dict in value_dict_by_pk.values():
+        for field_name in value_dict.keys():
+            if not field_name in field_name_set:
+                field_name_set.add(field_name)
+                field = model._meta.get_field(field_name)
+                field_list_by_model.setdefault(field.model, []).append(field)
+
+    cursor = connection.cursor()
+    for field_model, field_list in field_list_by_model.items():
+        if len(field_list_by_model) == 1:
+            pk_list = value_dict_by_pk.keys()
+        else:
+            pk_list = [pk for pk, value_dict in value_dict_by_pk.items()
+                       if any([field.name in value_dict for field in field_list])]
+        pk_field = field_model._meta.pk
+        pk_column = quote_name(pk_field.column)
+        # Two parameters per changed field (primary key and value), and the
+        # primary key in the WHERE clause.
+        update_batch_size = min(max(connection.ops.bulk_batch_size(['pk'] * (2 * len(field_list) + 1), pk_list), 1),
+                                len(pk_list))
+        for index in range(0, len(pk_list), update_batch_size):
+            batch_pk_list = pk_list[index:index+update_batch_size]
+            set_sql_list = []
+            param_list = []
+            for field in field_list:
+                when_sql_list = []
+                for pk in batch_pk_list:
+                    if field.name in value_dict_by_pk[pk]:
+                        when_sql_list.append('WHEN %s THEN %s')
+                        param_list.append(pk_field.get_db_prep_value(pk, connection=connection))
+                        param_list.append(field.get_db_prep_save(value_dict_by_pk[pk][field.name],
+                                                                 connection=connection))
+                if not when_sql_list:
+                    continue
+                column = quote_name(field.column)
+                case_sql = 'CASE %s %s ELSE %s END' % (pk_column, ' '.join(when_sql_list), column)
+                if connection.vendor == 'postgresql':
+                    # The parameters have no type, the result of the CASE
+                    # would be text.
+                    case_sql = 'CAST(%s AS %s)' % (case_sql, field.db_type(connection))
+                set_sql_list.append('%s = %s' % (column, case_sql))
+            if not set_sql_list:
+                continue
+            param_list.extend([pk_field.get_db_prep_value(pk, connection=connection) for pk in batch_pk_list])
+            cursor.execute('UPDATE %s SET %s WHERE %s IN (%s)' % (quote_name(field_model._meta.db_table),
+                                                                 ', '.join(set_sql_list),
+                                                                 pk_column,
+                                                                 ', '.join(['%s'] * len(batch_pk_list))),
+                           param_list)
+
+
+def _get_auto_now_field_name_list(model, excluded_field_name_list=()):
+    """Return the names of the auto_now fields of ``model`` (which are set
+    to the current time whenever an object is saved), except those in
+    ``excluded_field_name_list``."""
+    return [field.name for field in model._meta.fields
+            if getattr(field, 'auto_now', False) and not field.name in excluded_field_name_list]
+
 
+def _set_changed_fields(existing_object, import_object_dict):
+    """
+    Set the values of ``import_object_dict`` on ``existing_object``, for the
+    fields whose value differs from the current one. Values are normalized
+    using the model fields before being compared (related objects are
+    compared by primary key), so that, say, 3.0 read from a spreadsheet
+    doesn't change an integer field holding 3.
+
+    **Returns**
+
+    ``changed_field_name_list``
+        The names of the fields that were changed.
+
+    """
+    changed_field_name_list = []
+    for field_name, field_value in import_object_dict.items():
+        try:
+            field = existing_object._meta.get_field(field_name, many_to_many=False)
+        except FieldDoesNotExist:
+            setattr(existing_object, field_name, field_value)
+            changed_field_name_list.append(field_name)
+            continue
+        current_value = getattr(existing_object, field.attname)
+        if isinstance(field_value, models.Model):
+            new_value = field_value.pk
+        else:
+            try:
+                new_value = field.to_python(field_value)
+            except ValidationError:
+                new_value = field_value
+        if new_value == current_value:
+            continue
+        setattr(existing_object, field_name, field_value)
+        changed_field_name_list.append(field_name)
+    return changed_field_name_list
+
+
+def _get_identity_key(model, import_object_id_dict):
+    """
+    Build a hashable key from the identity dictionary of a row, so that rows
+    and database objects representing the same object can be matched in
+    memory. Values are normalized using the model fields (related objects are
+    replaced by their primary key), as the database would when running the
+    lookup.
+
+    Returns None if the identity can't be matched in memory (if it is empty
+    or uses fields that aren't simple columns of the model's table).
+
+    """
+    if not import_object_id_dict:
+        return None
+    identity_key = []
+    for field_name in sorted(import_object_id_dict.keys()):
+        try:
+            field = model._meta.get_field(field_name, many_to_many=False)
+        except FieldDoesNotExist:
+            return None
+        identity_key.append((field_name, _get_lookup_value(field, import_object_id_dict[field_name])))
+    return tuple(identity_key)
+
+
+def _get_lookup_value(field, field_value):
+    """Normalize a value of ``field`` using the field (related objects are
+    replaced by their primary key), as the database would when running a
+    lookup, so that values can be compared in memory."""
+    if isinstance(field_value, models.Model):
+        return field_value.pk
+    try:
+        return field.to_python(field_value)
+    except ValidationError:
+        return field_value
 
-def _do_relation_import(request, model_import_info, book, sheet, process_option_dict, status_dict):
+
+def _report_row_import(row, new_object, process_option_dict, status_dict):
+    status_msg = { 'description' : ('Valid row #%d (would be imported)' if status_dict.get('validate_only') else 'Imported row #%d') % row,
+                   'row' : row,
+                   'object_id' : new_object.pk }
+    status_dict['imported_count'] += 1
+    if process_option_dict['show_successful_imports']:
+        _append_message_sample(status_dict, 'combined_messages', status_msg)
+    _append_message_sample(status_dict, 'import_messages', status_msg)
+    _write_result_log(status_dict, RESULT_IMPORT, status_msg)
+
+
+def _report_row_update(row, updated_object, process_option_dict, status_dict):
+    status_msg = { 'description' : ('Valid row #%d (would update)' if status_dict.get('validate_only') else 'Updated row #%d') % row,
+                   'row' : row,
+                   'object_id' : updated_object.pk }
+    status_dict['updated_count'] += 1
+    if process_option_dict['show_successful_updates']:
+        _append_message_sample(status_dict, 'combined_messages', status_msg)
+    _append_message_sample(status_dict, 'update_messages', status_msg)
+    _write_result_log(status_dict, RESULT_UPDATE, status_msg)
+
+
+def _report_row_unchanged(row, existing_object, process_option_dict, status_dict):
+    status_msg = { 'description' : 'Unchanged row #%d'  % row,
+                   'row' : row,
+                   'object_id' : existing_object.pk }
+    status_dict['unchanged_count'] += 1
+    _write_result_log(status_dict, RESULT_UNCHANGED, status_msg)
+
+
+def _report_row_error(row, e, process_option_dict, status_dict):
+    status_msg = {'name' : 'Row processing error',
+                  'critical' : False if not process_option_dict['stop_on_first_error'] else True,
+                  'description' : str(e),
+                  'row' : row,
+                  'info' : ["Row : %s" % row,
+                            "Exception : %s" % str(type(e))]}
+    status_dict['error_count'] += 1
+    _append_message_sample(status_dict, 'error_messages', status_msg)
+    _write_result_log(status_dict, RESULT_ERROR, status_msg)
+
+
+def _report_import_error(filepath, e, status_dict):
+    status_msg = { 'name' : 'Import Error',
+                   'critical' : 'Yes',
+                   'description' : '%s' % str(e),
+                   'info' : ['File : %s' % filepath,
+                             'Exception : %s' % str(type(e)) ]}
+    # The import didn't go through, it can be resumed from its checkpoint.
+    status_dict['interrupted'] = True
+    status_dict['error_count'] += 1
+    _append_message_sample(status_dict, 'error_messages', status_msg)
+    _write_result_log(status_dict, RESULT_ERROR, status_msg)
+
+
+def _append_message_sample(status_dict, key, status_msg):
+    # The status dictionary only keeps the first messages, the full list is
+    # in the result log.
+    if len(status_dict[key]) < BATCHIMPORT_RESULT_SAMPLE_SIZE:
+        status_dict[key].append(status_msg)
+
+
+def _write_result_log(status_dict, kind, status_msg):
+    if status_dict.get('result_log') is not None:
+        status_dict['result_log'].write(kind, status_msg)
+
+
+def _do_relation_import(request, model_import_info, reader, process_option_dict, status_dict, progress=None):
     """
 	This function processes the incoming spreadsheet for relationship data.
 	It is assumed that each row in the spreadsheet has enough data to 
 	find two objects: a source object and a target object. This function
-	then simply finds both object, maps the target object to the source
-	object and saves the source object. 
+	then simply finds both object and maps the target object to the source
+	object. 
+	
+	Rows are processed in chunks: the source and target objects of a chunk
+	are looked up with one query each, and the missing links are inserted
+	in the relationship's intermediary table with a single bulk insert
+	(``save()`` and the ``m2m_changed`` signal are not called). This is
+	only done for intermediary tables created by Django: relationships
+	declared with a ``through`` model of their own can't be imported (as
+	their links can't be added with ``add()`` either), and raise ValueError.
 	
     **Required arguments**
     
     ``request``
     	Current HTTP request. This is used in case your override function needs
-    	current session information.
+    	current session information. It is None for imports that run in the
+    	background (see batchimport.jobs).
     	
 	``model_import_info``
 		This is the ModelImportInfo class (from batchimport.util) that holds 
 		all the various mapping information for the models and their fields.
 		
-	``book``
-		Current Excel workbook being processed.
-		
-	``sheet``
-		The current worksheet in the workbook being processed.
+	``reader``
+		The reader (from batchimport.readers) giving access to the rows of
+		the spreadsheet being processed.
 		
 	``process_option_dict``
 		This is a dictionary specifying the various mechanics options for 
@@ -138,47 +1339,182 @@ def _do_relation_import(request, model_import_info, book, sheet, process_option_
     
     **Optional arguments**
        
-    none.    
+    ``progress``
+    	An ImportProgress (from batchimport.progress) to which the progress of
+    	the import is reported as rows get processed.
     
     """
-    relationship_source_id_dict = {}
-    relationship_target_id_dict = {}
-    for row in range(process_option_dict['start_row']-1,process_option_dict['end_row']):
-        status_dict['processed_count'] += 1
-        try:
-            row_value_list = []
-            for cell in sheet.row(row):
-                if cell.ctype == 3:
-                    date_tuple = xlrd.xldate_as_tuple(cell.value, book.datemode)
-                    cell_value = str(date_tuple[0]) + '-' + str(date_tuple[1])  + '-' + str(date_tuple[2])
-                else:
-                    cell_value = cell.value
-                row_value_list.append(cell_value)
+    source_model = model_import_info.source_model
+    mapping_field = source_model._meta.get_field(model_import_info.mapping_field_name)
+    if not mapping_field.rel.through._meta.auto_created:
+        raise ValueError("Can't import the %s relationship of %s, as it uses the %s intermediary model "
+                         "(whose objects must be created on their own)." % \
+                         (mapping_field.name, source_model._meta.object_name,
+                          mapping_field.rel.through._meta.object_name))
 
-            relationship_source_id_dict = model_import_info.get_relationship_source_id_dict(request, row_value_list)
-            relationship_target_id_dict = model_import_info.get_relationship_target_id_dict(request, row_value_list)
+    transaction_size = process_option_dict.get('transaction_size') or BATCHIMPORT_TRANSACTION_SIZE
+    using = router.db_for_write(source_model)
+    model_import_info.reset_related_object_cache()
+    model_import_info.reset_value_override_stats()
+
+    # Rows are committed in chunks of transaction_size rows, with a
+    # checkpoint after each chunk.
+    row_iterator = reader.iter_rows(_get_first_row_index(process_option_dict, status_dict),
+                                    _get_end_row_index(process_option_dict))
+    stop_import = False
+    while not stop_import:
+        chunk_row_list = list(islice(row_iterator, transaction_size))
+        if not chunk_row_list:
+            break
+        with transaction.atomic(using=using):
+            if not _import_relation_chunk(request, model_import_info, chunk_row_list,
+                                          process_option_dict, status_dict, using):
+                stop_import = True
+        _save_checkpoint(status_dict, chunk_row_list[-1][0] + 1)
+        if progress is not None:
+            progress.update(status_dict)
+
+    status_dict['related_cache_hits'], status_dict['related_cache_misses'] = model_import_info.get_related_object_cache_stats()
+    status_dict['override_stats'] = model_import_info.get_value_override_stats()
+    return status_dict
+
+
+def _import_relation_chunk(request, model_import_info, chunk_row_list, process_option_dict, status_dict, using):
+    """
+    Import a chunk of rows (a list of (row index, row value list) tuples) for
+    ``_do_relation_import``: find the source and target objects of every row
+    using one query per model, then add the links between them.
 
-            source_object = model_import_info.source_model.objects.get(**relationship_source_id_dict)
-            target_object = model_import_info.target_model.objects.get(**relationship_target_id_dict)
+    Returns False if the import should stop (i.e. an error occured and the
+    options say to stop on the first error), True otherwise.
 
-            related_field_collection = getattr(source_object, model_import_info.mapping_field_name)
-            related_field_collection.add(target_object)
+    """
+    source_model = model_import_info.source_model
+    target_model = model_import_info.target_model
+    row_value_list_list = [row_value_list for row, row_value_list in chunk_row_list]
+    model_import_info.prefetch_related_objects(row_value_list_list, source_model.__name__)
+    model_import_info.prefetch_related_objects(row_value_list_list, target_model.__name__)
+
+    mapped_row_list = []
+    for row, row_value_list in chunk_row_list:
+        try:
+            relationship_source_id_dict = model_import_info.get_relationship_source_id_dict(request, row_value_list)
+            relationship_target_id_dict = model_import_info.get_relationship_target_id_dict(request, row_value_list)
+            _check_lookup_values(source_model, relationship_source_id_dict)
+            _check_lookup_values(target_model, relationship_target_id_dict)
+            mapped_row_list.append((row, relationship_source_id_dict, relationship_target_id_dict, None))
+        except Exception, e:
+            mapped_row_list.append((row, None, None, e))
 
-            source_object.save()
+    source_object_dict = _get_existing_object_dict(source_model,
+                                                   [mapped_row[1] for mapped_row in mapped_row_list
+                                                    if mapped_row[3] is None])
+    target_object_dict = _get_existing_object_dict(target_model,
+                                                   [mapped_row[2] for mapped_row in mapped_row_list
+                                                    if mapped_row[3] is None])
 
-            status_msg = 'Updated : #%d' % str(row)
-            status_dict['updated_count'] += 1
-            if process_option_dict['show_successful_updates']:
-                status_dict['combined_messages'].append(status_msg)
-            status_dict['update_messages'].append(status_msg)
+    link_list = []
+    keep_going = True
+    for row, relationship_source_id_dict, relationship_target_id_dict, mapping_error in mapped_row_list:
+        status_dict['processed_count'] += 1
+        try:
+            if mapping_error is not None:
+                raise mapping_error
+            source_object = _get_related_end_object(source_model, source_object_dict, relationship_source_id_dict)
+            target_object = _get_related_end_object(target_model, target_object_dict, relationship_target_id_dict)
+            link_list.append((row, source_object, target_object))
         except Exception, e:
-            status_dict['error_messags'].append({'name' : 'Row processing error',
-                                                 'critical' : 'No' if not process_option_dict['stop_on_first_error'] else "Yes",
-                                                 'description' : str(sys.exc_info()[1]),
-                                                 'info' : ['Row: %s' % row,
-                                                           'Exception : %s' % str(type(e))]})
+            _report_row_error(row, e, process_option_dict, status_dict)
             if process_option_dict['stop_on_first_error']:
+                keep_going = False
                 break
 
-    return status_dict
+    if link_list and process_option_dict.get('validate_only'):
+        # Both ends of each link were found, there's nothing else to check.
+        for row, source_object, target_object in link_list:
+            _report_row_update(row, source_object, process_option_dict, status_dict)
+    elif link_list:
+        if not _add_relation_links(model_import_info, link_list, process_option_dict, status_dict, using):
+            keep_going = False
+    return keep_going
+
+
+def _get_related_end_object(model, existing_object_dict, import_object_id_dict):
+    """Return the object (found by ``_get_existing_object_dict``) matching
+    the identity dictionary of one end of a relationship, raising
+    ``DoesNotExist`` just like ``model.objects.get()`` would if there is
+    none."""
+    existing_object = _get_existing_object(model, existing_object_dict,
+                                           _get_identity_key(model, import_object_id_dict),
+                                           import_object_id_dict)
+    if existing_object is None:
+        raise model.DoesNotExist("%s matching query does not exist." % model._meta.object_name)
+    return existing_object
+
+
+def _add_relation_links(model_import_info, link_list, process_option_dict, status_dict, using):
+    """
+    Add the links of ``link_list`` (a list of (row index, source object,
+    target object) tuples) to the many-to-many relationship being imported,
+    and report each row as an update of its source object. Links that
+    already exist are looked up and left out, and the others are inserted
+    in the intermediary table with a single ``bulk_create`` (this is what
+    the related manager's ``add()`` does, for a whole chunk of rows at once).
+    If that fails (it runs in a savepoint, so nothing has been written in
+    that case), the links are added one row at a time using ``add()``
+    instead, so that the error can be reported against the row it comes
+    from.
+
+    Returns False if the import should stop (i.e. an error occured and the
+    options say to stop on the first error), True otherwise.
+
+    """
+    source_model = model_import_info.source_model
+    mapping_field = source_model._meta.get_field(model_import_info.mapping_field_name)
+    through_model = mapping_field.rel.through
+    source_field_name = mapping_field.m2m_field_name()
+    target_field_name = mapping_field.m2m_reverse_field_name()
+    source_attname = through_model._meta.get_field(source_field_name).attname
+    target_attname = through_model._meta.get_field(target_field_name).attname
+
+    link_key_set = set()
+    link_key_list = []
+    for row, source_object, target_object in link_list:
+        link_key_tuple = ((source_object.pk, target_object.pk),)
+        # Symmetrical relationships (to self) are stored both ways.
+        if mapping_field.rel.symmetrical and source_model is model_import_info.target_model:
+            link_key_tuple += ((target_object.pk, source_object.pk),)
+        for link_key in link_key_tuple:
+            if not link_key in link_key_set:
+                link_key_set.add(link_key)
+                link_key_list.append(link_key)
+
+    try:
+        with transaction.atomic(using=using):
+            manager = through_model._default_manager.using(using)
+            connection = connections[using]
+            lookup_batch_size = max(connection.ops.bulk_batch_size([source_field_name, target_field_name],
+                                                                   link_key_list), 1)
+            existing_link_key_set = set()
+            for index in range(0, len(link_key_list), lookup_batch_size):
+                lookup_link_key_list = link_key_list[index:index+lookup_batch_size]
+                query_set = manager.filter(**{str(source_field_name + '__in'): set([link_key[0] for link_key in lookup_link_key_list]),
+                                              str(target_field_name + '__in'): set([link_key[1] for link_key in lookup_link_key_list])})
+                existing_link_key_set.update(query_set.values_list(source_field_name, target_field_name))
+            manager.bulk_create([through_model(**{source_attname: link_key[0], target_attname: link_key[1]})
+                                 for link_key in link_key_list if not link_key in existing_link_key_set])
+    except Exception:
+        for row, source_object, target_object in link_list:
+            try:
+                with transaction.atomic(using=using):
+                    getattr(source_object, model_import_info.mapping_field_name).add(target_object)
+                _report_row_update(row, source_object, process_option_dict, status_dict)
+            except Exception, e:
+                _report_row_error(row, e, process_option_dict, status_dict)
+                if process_option_dict['stop_on_first_error']:
+                    return False
+        return True
 
+    for row, source_object, target_object in link_list:
+        _report_row_update(row, source_object, process_option_dict, status_dict)
+    return True
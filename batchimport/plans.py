@@ -0,0 +1,117 @@
+"""
+Storage of import plans.
+
+An import plan is the compact, JSON-serializable description of an import
+built from the options form (see ModelImportInfo.get_plan_dict). Plans are
+stored as files in BATCHIMPORT_TEMPDIR, named after a hash of their content,
+so that only that name (the plan key) has to be kept in the session between
+the options view and the run view, instead of the pickled ModelImportInfo.
+
+The ModelImportInfo objects built from the plans are kept in a small
+in-process cache, so that a plan is only read and compiled once per process.
+
+Plans that haven't been saved again for BATCHIMPORT_PLAN_MAX_AGE seconds
+are deleted when a plan is saved (see ``delete_old_import_plans``).
+
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from os.path import join, getmtime
+
+from batchimport.batchimport_settings import *
+from batchimport.utils import LRUCache, ModelImportInfo
+
+# Number of compiled plans kept in the in-process cache.
+IMPORT_INFO_CACHE_SIZE = 32
+
+_import_info_cache = LRUCache(IMPORT_INFO_CACHE_SIZE)
+_import_info_cache_lock = threading.Lock()
+
+
+PLAN_FILE_PREFIX = 'batchimport_plan_'
+PLAN_FILE_SUFFIX = '.json'
+
+
+def get_plan_path(plan_key):
+    return join(BATCHIMPORT_TEMPDIR, PLAN_FILE_PREFIX + plan_key + PLAN_FILE_SUFFIX)
+
+
+def dump_import_plan(plan_dict):
+    return json.dumps(plan_dict, sort_keys=True, separators=(',', ':'))
+
+
+def save_import_plan(model_import_info):
+    """
+    Store the import plan of ``model_import_info`` and return its key.
+
+    """
+    plan_json = dump_import_plan(model_import_info.get_plan_dict())
+    plan_key = hashlib.sha1(plan_json).hexdigest()
+    with open(get_plan_path(plan_key), 'wb') as f:
+        f.write(plan_json)
+    with _import_info_cache_lock:
+        _import_info_cache.set(plan_key, model_import_info)
+    delete_old_import_plans()
+    return plan_key
+
+
+def delete_old_import_plans(max_age=None):
+    """
+    Delete the stored import plans that haven't been saved for ``max_age``
+    seconds (BATCHIMPORT_PLAN_MAX_AGE by default, None keeps every plan).
+
+    """
+    if max_age is None:
+        max_age = BATCHIMPORT_PLAN_MAX_AGE
+    if max_age is None:
+        return
+    expired = time.time() - max_age
+    try:
+        file_name_list = os.listdir(BATCHIMPORT_TEMPDIR)
+    except OSError:
+        return
+    for file_name in file_name_list:
+        if not (file_name.startswith(PLAN_FILE_PREFIX) and file_name.endswith(PLAN_FILE_SUFFIX)):
+            continue
+        filepath = join(BATCHIMPORT_TEMPDIR, file_name)
+        try:
+            if getmtime(filepath) < expired:
+                os.remove(filepath)
+        except OSError:
+            # Deleted meanwhile by another process.
+            pass
+
+
+def load_import_plan(plan_key):
+    """Return the import plan stored under ``plan_key``. Raises KeyError if
+    there is no such plan."""
+    if not plan_key.isalnum():
+        raise KeyError(plan_key)
+    try:
+        with open(get_plan_path(plan_key), 'rb') as f:
+            return json.load(f)
+    except IOError:
+        raise KeyError(plan_key)
+
+
+def get_import_info(plan_key):
+    """
+    Return a ModelImportInfo built from the import plan stored under
+    ``plan_key``. Raises KeyError if there is no such plan.
+
+    The compiled ModelImportInfo is cached, and each call returns a copy
+    of it with its own per-import state (see
+    ``ModelImportInfo.get_import_copy``), so that imports running at the
+    same time don't share their related object cache or override stats.
+
+    """
+    with _import_info_cache_lock:
+        model_import_info = _import_info_cache.get(plan_key)
+    if model_import_info is None:
+        model_import_info = ModelImportInfo.from_plan_dict(load_import_plan(plan_key))
+        with _import_info_cache_lock:
+            _import_info_cache.set(plan_key, model_import_info)
+    return model_import_info.get_import_copy()
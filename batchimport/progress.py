@@ -0,0 +1,112 @@
+"""
+Progress reporting for running imports.
+
+The import functions (see batchimport.parser) tell an ImportProgress
+object about the rows they have processed, and it publishes the counters,
+along with the throughput and an estimated time of arrival, to the Django
+cache. The progress view (see batchimport.views) reads them back from there.
+
+Publishing is rate-limited (see BATCHIMPORT_PROGRESS_ROWS and
+BATCHIMPORT_PROGRESS_INTERVAL), and checking whether it's time to publish
+costs an integer comparison, so reporting doesn't slow the import down.
+
+Note that the cache must be shared between the web workers and the import
+workers (i.e. not the default local-memory cache if you use several web
+processes or the 'process' job backend).
+
+"""
+import time
+
+from django.core.cache import cache
+
+from batchimport.batchimport_settings import *
+
+# Published progress is kept for a day after the last update.
+PROGRESS_TIMEOUT = 24 * 60 * 60
+
+
+def get_progress_key(import_id):
+    return 'batchimport_progress_%s' % import_id
+
+
+def get_progress(import_id):
+    """Return the last progress dictionary published for the given import,
+    or None."""
+    return cache.get(get_progress_key(import_id))
+
+
+def delete_progress(import_id):
+    cache.delete(get_progress_key(import_id))
+
+
+class ImportProgress(object):
+    """
+    Publishes the progress of an import, identified by ``import_id``
+    ('job-<pk>' for background jobs, 'session-<session key>' for imports
+    running in ImportRunView). ``start_count`` is the number of rows already
+    processed when the import starts (when resuming it from a checkpoint),
+    which the throughput doesn't account for.
+
+    """
+    # How often (in processed rows) the clock is checked.
+    CHECK_ROWS = 50
+
+    def __init__(self, import_id, every_rows=None, every_seconds=None, start_count=0):
+        self.import_id = import_id
+        self.start_count = start_count
+        self.every_rows = every_rows or BATCHIMPORT_PROGRESS_ROWS
+        self.every_seconds = every_seconds or BATCHIMPORT_PROGRESS_INTERVAL
+        self.start_time = time.time()
+        self._next_check_count = start_count
+        self._last_publish_count = start_count
+        self._last_publish_time = self.start_time
+
+    def update(self, status_dict):
+        """Called by the import functions as rows get processed. Publishes
+        the progress if enough rows were processed or enough time went by
+        since it was last published."""
+        processed_count = status_dict['processed_count']
+        if processed_count < self._next_check_count:
+            return
+        self._next_check_count = processed_count + min(ImportProgress.CHECK_ROWS, self.every_rows)
+        now = time.time()
+        if processed_count - self._last_publish_count >= self.every_rows or \
+           now - self._last_publish_time >= self.every_seconds:
+            self.publish(status_dict, now=now)
+
+    def finish(self, status_dict):
+        """Publish the final progress of the import."""
+        self.publish(status_dict, finished=True)
+
+    def publish(self, status_dict, now=None, finished=False):
+        now = now or time.time()
+        self._last_publish_count = status_dict['processed_count']
+        self._last_publish_time = now
+        cache.set(get_progress_key(self.import_id),
+                  self.get_progress_dict(status_dict, now, finished),
+                  PROGRESS_TIMEOUT)
+
+    def get_progress_dict(self, status_dict, now, finished=False):
+        processed_count = status_dict['processed_count']
+        total_count = None
+        if status_dict.get('end_row', -1) > -1 and status_dict.get('start_row'):
+            total_count = max(status_dict['end_row'] - status_dict['start_row'] + 1, 0)
+        elapsed_seconds = now - self.start_time
+        rows_per_second = None
+        eta_seconds = None
+        if elapsed_seconds > 0 and processed_count > self.start_count:
+            rows_per_second = (processed_count - self.start_count) / elapsed_seconds
+            if total_count is not None:
+                eta_seconds = max(total_count - processed_count, 0) / rows_per_second
+        if finished:
+            eta_seconds = 0
+        return {'finished': finished,
+                'total_count': total_count,
+                'processed_count': processed_count,
+                'imported_count': status_dict['imported_count'],
+                'updated_count': status_dict['updated_count'],
+                'unchanged_count': status_dict['unchanged_count'],
+                'error_count': status_dict['error_count'],
+                'elapsed_seconds': elapsed_seconds,
+                'rows_per_second': rows_per_second,
+                'eta_seconds': eta_seconds}
@@ -0,0 +1,304 @@
+"""
+Spreadsheet readers used by the import process.
+
+A reader gives access to the rows of the first sheet of an uploaded file as
+lists of cell values, reading them lazily whenever the file format allows it,
+so that the whole file doesn't have to be loaded in memory before the import
+starts. Use ``get_reader`` to obtain the right reader for a file.
+
+Cell values are returned as native values: unicode strings, numbers, and
+``datetime`` objects for date cells (they are converted for the model
+fields later, see batchimport.converters). Empty cells are empty strings.
+
+"""
+import csv
+import zlib
+from os.path import splitext
+
+import xlrd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from batchimport.batchimport_settings import *
+
+
+CSV_EXTENSIONS = ('.csv', '.tsv', '.tab', '.txt')
+TSV_EXTENSIONS = ('.tsv', '.tab')
+XLS_EXTENSIONS = ('.xls',)
+XLSX_EXTENSIONS = ('.xlsx', '.xlsm')
+
+# Signatures found at the start of Excel files: XLS files are OLE2 compound
+# documents and XLSX files are ZIP archives.
+OLE2_SIGNATURE = '\xd0\xcf\x11\xe0'
+ZIP_SIGNATURE = 'PK\x03\x04'
+
+
+def get_reader(filepath):
+    """
+    Return a reader for the file whose path is ``filepath``, chosen using
+    the file extension, or by looking at the start of the file if the
+    extension is unknown. XLSX files are streamed using openpyxl if it is
+    installed, and read using xlrd otherwise.
+
+    """
+    extension = splitext(filepath)[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return CSVReader(filepath)
+    if not extension in XLS_EXTENSIONS + XLSX_EXTENSIONS:
+        with open(filepath, 'rb') as f:
+            signature = f.read(4)
+        if signature == ZIP_SIGNATURE:
+            extension = XLSX_EXTENSIONS[0]
+        elif not signature == OLE2_SIGNATURE:
+            return CSVReader(filepath)
+    if extension in XLSX_EXTENSIONS and openpyxl is not None:
+        return XLSXReader(filepath)
+    return XLSReader(filepath)
+
+
+class BaseReader(object):
+    """
+    Base class for the readers. Subclasses must implement ``iter_rows``,
+    ``get_nrows`` and ``get_ncols``, and may implement ``close`` to release
+    the resources held by the reader.
+
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    @property
+    def nrows(self):
+        return self.get_nrows()
+
+    @property
+    def ncols(self):
+        return self.get_ncols()
+
+    def get_nrows(self):
+        raise NotImplementedError
+
+    def get_ncols(self):
+        raise NotImplementedError
+
+    def get_counted_nrows(self):
+        """Return the number of rows if it is known without going through
+        the whole file, None otherwise."""
+        return self.get_nrows()
+
+    def iter_rows(self, start_row=0, end_row=None):
+        """Yield a (row index, list of cell values) tuple for each row from
+        ``start_row`` (included) to ``end_row`` (excluded, or up to the last
+        row if None). Row indexes start at 0."""
+        raise NotImplementedError
+
+    def get_row(self, row):
+        """Return the list of cell values of a single row."""
+        for row_index, row_value_list in self.iter_rows(row, row + 1):
+            return row_value_list
+        raise IndexError("row index %d out of range" % row)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class XLSReader(BaseReader):
+    """
+    Reader for Excel files, using xlrd. The workbook is opened with
+    ``on_demand=True`` so that only the first sheet gets loaded, and that
+    sheet is unloaded when the reader is closed.
+
+    """
+    def __init__(self, filepath):
+        super(XLSReader, self).__init__(filepath)
+        self.book = xlrd.open_workbook(filepath, on_demand=True)
+        self.sheet = self.book.sheet_by_index(0)
+
+    def get_nrows(self):
+        return self.sheet.nrows
+
+    def get_ncols(self):
+        return self.sheet.ncols
+
+    def iter_rows(self, start_row=0, end_row=None):
+        if end_row is None or end_row > self.sheet.nrows:
+            end_row = self.sheet.nrows
+        for row in range(start_row, end_row):
+            cell_value_list = self.sheet.row_values(row)
+            cell_type_list = self.sheet.row_types(row)
+            # Only rows holding dates need their values to be looked at.
+            if xlrd.XL_CELL_DATE in cell_type_list:
+                self._convert_dates(cell_value_list, cell_type_list)
+            yield row, cell_value_list
+
+    def close(self):
+        if self.book is not None:
+            self.book.unload_sheet(0)
+            self.book.release_resources()
+            self.book = None
+
+    def _convert_dates(self, cell_value_list, cell_type_list):
+        # Dates are stored as numbers of days, turn them into datetimes
+        # (keeping invalid ones as numbers).
+        for col, cell_type in enumerate(cell_type_list):
+            if cell_type == xlrd.XL_CELL_DATE:
+                try:
+                    cell_value_list[col] = xlrd.xldate.xldate_as_datetime(cell_value_list[col], self.book.datemode)
+                except xlrd.xldate.XLDateError:
+                    pass
+
+
+class XLSXReader(BaseReader):
+    """
+    Reader for Office Open XML files, using openpyxl in read-only mode:
+    rows are parsed from the file as they are iterated over instead of
+    being loaded all at once.
+
+    """
+    def __init__(self, filepath):
+        super(XLSXReader, self).__init__(filepath)
+        self.book = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        self.sheet = self.book.worksheets[0]
+        self._nrows = None
+
+    def get_nrows(self):
+        if self._nrows is None:
+            self._nrows = self.sheet.max_row
+            if self._nrows is None:
+                # The file doesn't declare its dimensions, count the rows.
+                self._nrows = sum(1 for row in self.sheet.iter_rows())
+        return self._nrows
+
+    def get_counted_nrows(self):
+        if self._nrows is None:
+            return self.sheet.max_row
+        return self._nrows
+
+    def get_ncols(self):
+        if self.sheet.max_column is None:
+            return len(self.get_row(0))
+        return self.sheet.max_column
+
+    def iter_rows(self, start_row=0, end_row=None):
+        row = start_row
+        for cell_value_tuple in self.sheet.iter_rows(min_row=start_row + 1, max_row=end_row, values_only=True):
+            # Keep empty cells consistent with what xlrd returns for XLS
+            # files.
+            yield row, [u'' if cell_value is None else cell_value for cell_value in cell_value_tuple]
+            row += 1
+
+    def close(self):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+
+
+class CSVReader(BaseReader):
+    """
+    Reader for CSV/TSV files, using the csv module. Rows are read from the
+    file as they are iterated over, and cell values are decoded using the
+    given encoding. If no dialect is given (here or in the settings), TSV
+    files use the 'excel-tab' dialect and the dialect of other files is
+    guessed from their first lines. Rows are counted when they are read up
+    to the end of the file, so that counting them doesn't take a pass over
+    the file of its own once they have been.
+
+    """
+    SNIFF_SIZE = 64 * 1024
+
+    def __init__(self, filepath, dialect=None, encoding=None):
+        super(CSVReader, self).__init__(filepath)
+        self.encoding = encoding or BATCHIMPORT_CSV_ENCODING
+        self.dialect = dialect or BATCHIMPORT_CSV_DIALECT or self._guess_dialect()
+        self._nrows = None
+
+    def get_nrows(self):
+        if self._nrows is None:
+            with open(self.filepath, 'rb') as f:
+                self._nrows = sum(1 for row in csv.reader(f, self.dialect))
+        return self._nrows
+
+    def get_counted_nrows(self):
+        return self._nrows
+
+    def get_ncols(self):
+        return len(self.get_row(0))
+
+    def iter_rows(self, start_row=0, end_row=None):
+        with open(self.filepath, 'rb') as f:
+            row = -1
+            for row, cell_value_list in enumerate(csv.reader(f, self.dialect)):
+                if end_row is not None and row >= end_row:
+                    break
+                if row >= start_row:
+                    yield row, [cell_value.decode(self.encoding) for cell_value in cell_value_list]
+            else:
+                self._nrows = row + 1
+
+    def _guess_dialect(self):
+        if splitext(self.filepath)[1].lower() in TSV_EXTENSIONS:
+            return 'excel-tab'
+        with open(self.filepath, 'rb') as f:
+            sample = f.read(CSVReader.SNIFF_SIZE)
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            return 'excel'
+
+
+class ShardReader(BaseReader):
+    """
+    Wraps another reader to only give access to one shard of its rows, for
+    imports running in parallel (see batchimport.parser). Rows are assigned
+    to one of ``shard_count`` shards using a hash of the values of the
+    columns whose index is in ``column_index_list`` (the identity columns),
+    so that rows representing the same object always end up in the same
+    shard.
+
+    """
+    def __init__(self, reader, column_index_list, shard_index, shard_count):
+        super(ShardReader, self).__init__(reader.filepath)
+        self.reader = reader
+        self.column_index_list = column_index_list
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+
+    def get_nrows(self):
+        return self.reader.nrows
+
+    def get_counted_nrows(self):
+        return self.reader.get_counted_nrows()
+
+    def get_ncols(self):
+        return self.reader.ncols
+
+    def iter_rows(self, start_row=0, end_row=None):
+        for row, row_value_list in self.reader.iter_rows(start_row, end_row):
+            if self.get_shard_index(row_value_list) == self.shard_index:
+                yield row, row_value_list
+
+    def get_shard_index(self, row_value_list):
+        identity_value_list = []
+        for column_index in self.column_index_list:
+            if column_index < len(row_value_list):
+                identity_value_list.append(_normalize_identity_value(row_value_list[column_index]))
+        return zlib.crc32(u'\x00'.join(identity_value_list).encode('utf-8')) % self.shard_count
+
+    def close(self):
+        self.reader.close()
+
+
+def _normalize_identity_value(value):
+    # Values that only differ by case, surrounding spaces or by being a
+    # float rather than an int must be hashed the same way.
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return unicode(value).strip().lower()
@@ -0,0 +1,179 @@
+"""
+Logs of the per-row results of imports.
+
+The import functions (see batchimport.parser) only keep counters and a
+small sample of the result messages in the status dictionary (see
+BATCHIMPORT_RESULT_SAMPLE_SIZE). Every message is also written, as it
+happens, to an ImportResultLog: a file in BATCHIMPORT_TEMPDIR holding one
+JSON object per line, which the results view (see batchimport.views) reads
+back a page at a time. Messages only hold the row number and the primary
+key of the object, never the object itself, so the memory used by an import
+doesn't grow with the number of rows.
+
+"""
+import csv
+import json
+import os
+import shutil
+from itertools import islice
+from os.path import join
+
+from batchimport.batchimport_settings import *
+
+RESULT_IMPORT = 'import'
+RESULT_UPDATE = 'update'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_ERROR = 'error'
+
+# Kinds of messages listed for each of the message lists of the status
+# dictionary (rows left unchanged are only listed in the log).
+RESULT_KINDS_BY_LIST_NAME = {'combined': (RESULT_IMPORT, RESULT_UPDATE),
+                             'import': (RESULT_IMPORT,),
+                             'update': (RESULT_UPDATE,),
+                             'unchanged': (RESULT_UNCHANGED,),
+                             'error': (RESULT_ERROR,)}
+
+# Action written in CSV reports for each kind of message.
+REPORT_ACTION_BY_KIND = {RESULT_IMPORT: 'imported',
+                         RESULT_UPDATE: 'updated',
+                         RESULT_UNCHANGED: 'unchanged',
+                         RESULT_ERROR: 'error'}
+REPORT_HEADER = ('row', 'action', 'object_id', 'description')
+
+
+def get_result_log_path(import_id):
+    return join(BATCHIMPORT_TEMPDIR, 'batchimport_results_%s.log' % import_id)
+
+
+class ImportResultLog(object):
+    """
+    The result log of an import, identified by ``import_id`` (see
+    batchimport.progress). Messages are appended to the file as they are
+    written, the file being opened on the first write and kept open until
+    the log is closed. The log can be pickled (to be sent to another
+    process, for example), the file is simply opened again on the next
+    write.
+
+    """
+    def __init__(self, import_id):
+        self.import_id = import_id
+        self.path = get_result_log_path(import_id)
+        self._file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    def clear(self):
+        """Start a new, empty log."""
+        self.close()
+        open(self.path, 'wb').close()
+
+    def write(self, kind, message_dict):
+        """Append a message (a dictionary that can be serialized to JSON) of
+        the given kind (RESULT_IMPORT, RESULT_UPDATE, RESULT_UNCHANGED or
+        RESULT_ERROR)."""
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        message_dict = dict(message_dict, kind=kind)
+        self._file.write(json.dumps(message_dict) + '\n')
+
+    def extend(self, result_log, delete=True):
+        """Append the messages of another log (of a shard of a parallel
+        import, for example) and delete that log, unless ``delete`` is
+        False."""
+        result_log.close()
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        try:
+            with open(result_log.path, 'rb') as f:
+                shutil.copyfileobj(f, self._file)
+        except IOError:
+            pass
+        if delete:
+            result_log.delete()
+
+    def sync(self):
+        """Write the messages written so far to disk (for a checkpoint, see
+        batchimport.checkpoints) and return the size of the log."""
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return os.fstat(self._file.fileno()).st_size
+
+    def truncate(self, size):
+        """Drop the messages written after the log had the given size (when
+        resuming an import from a checkpoint)."""
+        self.close()
+        with open(self.path, 'ab') as f:
+            if os.fstat(f.fileno()).st_size > size:
+                f.truncate(size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def delete(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def iter_messages(self, kind_list=None, offset=0, limit=None):
+        """Yield the messages of the log, in the order they were written,
+        optionally only those whose kind is in ``kind_list``, skipping the
+        first ``offset`` of them and stopping after ``limit`` of them."""
+        if self._file is not None:
+            self._file.flush()
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return
+        with f:
+            message_iterator = (self._load_message(line) for line in f)
+            message_iterator = (message_dict for message_dict in message_iterator
+                                if message_dict is not None and \
+                                   (kind_list is None or message_dict['kind'] in kind_list))
+            stop = None if limit is None else offset + limit
+            for message_dict in islice(message_iterator, offset, stop):
+                yield message_dict
+
+    def iter_report_lines(self, kind_list=None):
+        """Yield the lines of a CSV report of the messages of the log (only
+        those whose kind is in ``kind_list`` if given): a header line, then
+        one line per message holding the row, the action, the primary key of
+        the object and the description of the message. The log is read as
+        the lines are generated, it is never loaded in memory."""
+        line_buffer = _LineBuffer()
+        writer = csv.writer(line_buffer)
+        yield writer.writerow(REPORT_HEADER)
+        for message_dict in self.iter_messages(kind_list):
+            yield writer.writerow([_encode_report_value(message_dict.get('row')),
+                                   REPORT_ACTION_BY_KIND.get(message_dict['kind'], message_dict['kind']),
+                                   _encode_report_value(message_dict.get('object_id')),
+                                   _encode_report_value(message_dict.get('description'))])
+
+    def _load_message(self, line):
+        # The last line may be incomplete if the import is still running.
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+
+class _LineBuffer(object):
+    # csv writers write to a file, this one just hands the line back.
+    def write(self, line):
+        return line
+
+
+def _encode_report_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
@@ -16,7 +16,8 @@ up your own URL patterns for these views instead.
 
 from django.conf.urls import *
 
-from views import ImportUploadView, ImportOptionsView, ImportRunView
+from views import ImportUploadView, ImportOptionsView, ImportRunView, ImportJobView, ImportJobResumeView, \
+                  ImportProgressView, ImportResultsView, ImportResultsDownloadView
 
 urlpatterns = patterns('',
                        url(r'^upload/$',
@@ -28,4 +29,28 @@ urlpatterns = patterns('',
                        url(r'^run/$',
                            ImportRunView.as_view(),
                            name='batchimport_run'),
+                       url(r'^job/(?P<job_id>\d+)/$',
+                           ImportJobView.as_view(),
+                           name='batchimport_job'),
+                       url(r'^job/(?P<job_id>\d+)/resume/$',
+                           ImportJobResumeView.as_view(),
+                           name='batchimport_job_resume'),
+                       url(r'^progress/$',
+                           ImportProgressView.as_view(),
+                           name='batchimport_progress'),
+                       url(r'^progress/(?P<job_id>\d+)/$',
+                           ImportProgressView.as_view(),
+                           name='batchimport_job_progress'),
+                       url(r'^results/$',
+                           ImportResultsView.as_view(),
+                           name='batchimport_results'),
+                       url(r'^results/(?P<job_id>\d+)/$',
+                           ImportResultsView.as_view(),
+                           name='batchimport_job_results'),
+                       url(r'^results/download/$',
+                           ImportResultsDownloadView.as_view(),
+                           name='batchimport_results_download'),
+                       url(r'^results/(?P<job_id>\d+)/download/$',
+                           ImportResultsDownloadView.as_view(),
+                           name='batchimport_job_results_download'),
 )
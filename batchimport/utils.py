@@ -1,13 +1,38 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
 from os.path import join, isfile
 
 from django.conf import settings
-from django.db import models
-from django.db.models import get_model, related
-from django.db.models.fields import AutoField
-
-import xlrd
+from django.core.cache import cache
+from django.db import connections, models
+from django.db.models import get_model, related, Q
+from django.db.models.fields import AutoField, FieldDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, ImproperlyConfigured
+from django.utils.importlib import import_module
 
 from batchimport.batchimport_settings import *
+from batchimport.converters import DATE_VALUE_CLASSES, get_field_converter, format_date_value
+from batchimport.readers import get_reader
+
+# Marker used to tell cache misses apart from cached None values.
+_NOT_CACHED = object()
+
+# Sheet information is cached for a day.
+SHEET_INFO_TIMEOUT = 24 * 60 * 60
+
+# Model registry (see get_importable_model_list): the list of importable
+# models and relations, and the field lists of the models, built on first
+# use.
+_model_list = None
+_model_fields_dict = {}
+_model_registry_lock = threading.RLock()
+
+# Value overrides given as strings that look like this may be dotted paths
+# to functions, other strings are constant values.
+_DOTTED_PATH_RE = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)+$')
 
 def get_model_list():
     """
@@ -49,10 +74,101 @@ def get_model_list():
         model_list.append(relation)
     return model_list
 
-def get_column_choice_list(save_file_name):
+def get_importable_model_list():
+    """
+    Return the list of models (and relations) for which the user can batch
+    import information, as returned by ``get_model_list``. The list is built
+    on first use and then kept for the lifetime of the process.
+
+    """
+    global _model_list
+    with _model_registry_lock:
+        if _model_list is None:
+            _model_list = get_model_list()
+        return _model_list
+
+def get_importable_model_fields(model_name, importing_relations_only=False):
+    """
+    Return the list of field tuples of the given model, as returned by
+    ``get_model_fields``. The list is built on first use and then kept for
+    the lifetime of the process. The returned list must not be modified.
+
+    """
+    key = (model_name, importing_relations_only)
+    with _model_registry_lock:
+        try:
+            return _model_fields_dict[key]
+        except KeyError:
+            pass
+        field_tuple_list = get_model_fields(model_name, importing_relations_only)
+        _model_fields_dict[key] = field_tuple_list
+        return field_tuple_list
+
+def warm_model_registry():
+    """
+    Build the model registry (the importable model list, and the field
+    lists of these models) right away instead of on first use, from a WSGI
+    script or a worker start up hook for example.
+
+    """
+    for model_name, label in get_importable_model_list():
+        if '%' in model_name:
+            import_model_info_list = model_name.split('%')
+            get_importable_model_fields(import_model_info_list[0], True)
+            get_importable_model_fields(import_model_info_list[2], True)
+        else:
+            get_importable_model_fields(model_name)
+
+def reset_model_registry():
+    """Forget the model registry, so that it gets built again on next use
+    (for example after changing BATCHIMPORT_IMPORTABLE_MODELS in tests)."""
+    global _model_list
+    with _model_registry_lock:
+        _model_list = None
+        _model_fields_dict.clear()
+
+def get_file_hash(filepath):
+    """Return the SHA-1 hex digest of the content of the file whose path is
+    ``filepath``."""
+    file_hash = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def get_sheet_info(filepath, file_hash=None, reader=None):
+    """
+    Return a dictionary describing the spreadsheet whose path is
+    ``filepath``: its first row (``header``, usually the column headers).
+
+    Only the first row is read (streaming readers don't go through the
+    rest of the file, which is why the number of rows isn't part of the
+    information), and the result is cached in the Django cache using
+    the hash of the file content, which is computed if ``file_hash`` isn't
+    given. ``reader``, an open reader for the file, is used if given.
+
     """
-    Use xlrd to open the file whose name/path is sent in via ``save_file_name``.
-    Once open, retrieve a list of values representing the first value in
+    if file_hash is None:
+        file_hash = get_file_hash(filepath)
+    cache_key = 'batchimport_sheet_info_%s' % file_hash
+    sheet_info = cache.get(cache_key)
+    if sheet_info is not None:
+        return sheet_info
+    if reader is None:
+        with get_reader(filepath) as reader:
+            return get_sheet_info(filepath, file_hash, reader)
+    try:
+        header_row = reader.get_row(0)
+    except IndexError:
+        header_row = []
+    sheet_info = {'header': header_row}
+    cache.set(cache_key, sheet_info, SHEET_INFO_TIMEOUT)
+    return sheet_info
+
+def get_column_choice_list(save_file_name, file_hash=None):
+    """
+    Open the file whose name/path is sent in via ``save_file_name`` and
+    retrieve a list of values representing the first value in
     each column of the spreadsheet. Hopefully, this will be a header row
     but if it's not, it will be a list of sample values, one for each column.
     
@@ -62,6 +178,11 @@ def get_column_choice_list(save_file_name):
        The activation key to validate and use for activating the
        ``User``.
         
+    **Optional arguments**
+    
+    ``file_hash``
+       The hash of the file content, if known (see ``get_sheet_info``).
+        
     ** Returns**
     
     ``column_choice_list``
@@ -74,11 +195,9 @@ def get_column_choice_list(save_file_name):
     filepath = join(BATCHIMPORT_TEMPDIR, save_file_name)
     if not isfile(filepath):
         raise NameError, "%s is not a valid filename" % save_file_name
-    book = xlrd.open_workbook(filepath)
-    sheet = book.sheet_by_index(0)
+    header_row = get_sheet_info(filepath, file_hash)['header']
     column_index = 0
-    for column in range(0,sheet.ncols):
-        column_item = sheet.cell_value(rowx=0, colx=column)
+    for column_item in header_row:
         column_choice_list.append((column_index, column_item))
         column_index = column_index + 1
     return column_choice_list
@@ -213,6 +332,140 @@ def _get_relation_list(model):
                         continue
     return relation_tuple_list
 
+def _get_lookup_key(value):
+    """
+    Return the case-folded form of ``value`` (a cell value, or the value of
+    the mapping field of a related object) under which related objects are
+    matched, as the __iexact lookup would.
+
+    """
+    return unicode(value).lower()
+
+def cacheable_override(function):
+    """
+    Decorator marking a value override function as cacheable: its result
+    only depends on the cell value (not on the request), so that it is only
+    called once per distinct cell value during an import (up to
+    BATCHIMPORT_VALUE_OVERRIDE_CACHE_SIZE values are remembered).
+
+    """
+    function.batchimport_cacheable = True
+    return function
+
+def resolve_value_override(override, full_field_name):
+    """
+    Return a ValueOverride taking the request and the cell value, and
+    returning the value given by ``override``, an entry of
+    BATCHIMPORT_VALUE_OVERRIDES for the field named ``full_field_name``: a
+    callable, the dotted path to a function, or a constant value. Strings
+    that look like dotted paths (such as 'example.com') but don't name a
+    function that can be imported are constant values.
+
+    """
+    if callable(override):
+        return ValueOverride(full_field_name, override)
+    if isinstance(override, basestring) and _DOTTED_PATH_RE.match(override):
+        module_name, function_name = override.rsplit('.', 1)
+        try:
+            function = getattr(import_module(module_name), function_name)
+        except (ImportError, AttributeError):
+            function = None
+        if callable(function):
+            return ValueOverride(full_field_name, function)
+    return ValueOverride(full_field_name, lambda request, start_value: override, is_constant=True)
+
+
+class ValueOverride(object):
+    """
+    A resolved value override (see ``resolve_value_override``). Calling it
+    calls the override function, through a per-import cache of its results
+    if the function is marked with ``cacheable_override``, and keeps count
+    of the calls, cache hits and time spent in the function.
+
+    """
+    def __init__(self, name, function, is_constant=False):
+        self.name = name
+        self.function = function
+        self.is_constant = is_constant
+        self.is_cacheable = getattr(function, 'batchimport_cacheable', False)
+        self.reset()
+
+    def copy(self):
+        """Return a new ValueOverride calling the same function, with its
+        own cache and counters."""
+        return ValueOverride(self.name, self.function, self.is_constant)
+
+    def reset(self):
+        """Forget the cached results and the counters, at the start of an
+        import run."""
+        self.calls = 0
+        self.seconds = 0.0
+        self.cache = LRUCache(BATCHIMPORT_VALUE_OVERRIDE_CACHE_SIZE)
+
+    def __call__(self, request, start_value):
+        self.calls += 1
+        if self.is_cacheable:
+            # 1 and 1.0 (or u'1' and '1') are different cell values.
+            cache_key = (type(start_value), start_value)
+            try:
+                value = self.cache.get(cache_key, _NOT_CACHED)
+            except TypeError:
+                # Unhashable value, don't cache it.
+                cache_key = value = _NOT_CACHED
+            if value is not _NOT_CACHED:
+                return value
+        start_time = time.time()
+        value = self.function(request, start_value)
+        self.seconds += time.time() - start_time
+        if self.is_cacheable and cache_key is not _NOT_CACHED:
+            self.cache.set(cache_key, value)
+        return value
+
+    def get_stats_dict(self):
+        return {'name': self.name,
+                'cacheable': self.is_cacheable,
+                'calls': self.calls,
+                'cache_hits': self.cache.hits,
+                'seconds': self.seconds}
+
+
+class LRUCache(object):
+    """
+    A simple size-bounded cache that discards the least recently used
+    entries first, and keeps count of its hits and misses.
+
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._item_dict = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._item_dict.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # Re-insert the entry to mark it as the most recently used.
+        self._item_dict[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._item_dict.pop(key, None)
+        self._item_dict[key] = value
+        while len(self._item_dict) > self.max_size:
+            self._item_dict.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._item_dict
+
+    def __len__(self):
+        return len(self._item_dict)
+
 class ModelImportInfo(object):
     """
     The ModelImportInfo class handles all the management of the model
@@ -228,6 +481,10 @@ class ModelImportInfo(object):
     MAPPING_CHOICES = 3
     OBJECT_IMPORT = 1
     RELATIONSHIP_IMPORT = 2
+    RELATED_LOOKUP_PREFETCH = 'prefetch'
+    RELATED_LOOKUP_BATCH = 'batch'
+    RELATED_LOOKUP_QUERY = 'query'
+    RELATED_LOOKUP_STRATEGY_LIST = (RELATED_LOOKUP_PREFETCH, RELATED_LOOKUP_BATCH, RELATED_LOOKUP_QUERY)
     def __init__(self, import_model_name, field_value_dict, relation_info_dict):
         self.import_model_name = import_model_name
         self.field_value_dict = field_value_dict
@@ -264,7 +521,7 @@ class ModelImportInfo(object):
         self.default_by_field_name_dict = {self.model_for_import.__name__: {}}
         self.id_field_names_by_model_dict = {self.model_for_import.__name__: []}
         self.related_model_info_by_field_name_dict = {self.model_for_import.__name__: {}}
-        self.field_value_override_dict = {self.model_for_import.__name__: {}}
+        self.related_lookup_strategy_override_dict = {self.model_for_import.__name__: {}}
         
         if self.import_mode == ModelImportInfo.RELATIONSHIP_IMPORT:
             self.base_field_names_by_model[self.target_model.__name__] = []
@@ -272,7 +529,6 @@ class ModelImportInfo(object):
             self.default_by_field_name_dict[self.target_model.__name__] = {}
             self.id_field_names_by_model_dict[self.target_model.__name__] = []
             self.related_model_info_by_field_name_dict[self.target_model.__name__] = {}
-            self.field_value_override_dict[self.target_model.__name__] = {}
             
         for field_name in self.field_value_dict.keys():
             field_value = self.field_value_dict[field_name]
@@ -295,20 +551,299 @@ class ModelImportInfo(object):
                 self.related_model_info_by_field_name_dict[model_name][str(base_field_name)] = [relation_info_tuple[0],
                                                                                 relation_info_tuple[1],
                                                                                 str(field_value)]
-            if BATCHIMPORT_VALUE_OVERRIDES:
-                print 'in override code ' + full_model_name + ' ' + base_field_name 
                 try:
-                    override_value = batchimport_settings.BATCHIMPORT_VALUE_OVERRIDES[full_model_name][base_field_name]
-                    self.field_value_override_dict[model_name][base_field_name] = override_value
-                    print override_value
-                except:
-                    pass
+                    strategy = BATCHIMPORT_RELATED_LOOKUP_STRATEGIES[full_model_name][base_field_name]
+                except KeyError:
+                    continue
+                if not strategy in ModelImportInfo.RELATED_LOOKUP_STRATEGY_LIST:
+                    raise ImproperlyConfigured("Unknown related lookup strategy %r for %s.%s (expected one of %s)" % \
+                                               (strategy, full_model_name, base_field_name,
+                                                ', '.join(ModelImportInfo.RELATED_LOOKUP_STRATEGY_LIST)))
+                self.related_lookup_strategy_override_dict[model_name][str(base_field_name)] = strategy
+        self._resolve_value_overrides()
+        self._compile_column_plans()
     
+    # Keys used for the field options in import plans (see get_plan_dict).
+    PLAN_FIELD_KEY_BY_TYPE = OrderedDict([('xls_column', 'column'),
+                                          ('is_id_field', 'identity'),
+                                          ('default_value', 'default'),
+                                          ('mapping_choice', 'mapping')])
+
+    def get_plan_dict(self):
+        """
+        Return the import plan: a compact dictionary, which can be serialized
+        to JSON, holding everything needed to build this ModelImportInfo
+        again (see ``from_plan_dict``), i.e. the name of the model for import,
+        and for each field its column, whether it is an identity field, its
+        default value and its mapping choice (only the options that are set),
+        along with the related model of the mapped related fields.
+
+        """
+        field_plan_dict = {}
+        relation_plan_dict = {}
+        for field_name, field_value in self.field_value_dict.items():
+            full_field_name, field_type = field_name.rsplit('-', 1)
+            field_plan = field_plan_dict.setdefault(full_field_name, {})
+            if field_type == 'xls_column':
+                if int(field_value or -1) > -1:
+                    field_plan['column'] = int(field_value)
+            elif field_value and field_type in ModelImportInfo.PLAN_FIELD_KEY_BY_TYPE:
+                field_plan[ModelImportInfo.PLAN_FIELD_KEY_BY_TYPE[field_type]] = field_value
+                if field_type == 'mapping_choice':
+                    relation_plan_dict[full_field_name] = list(self.relation_info_dict[full_field_name][:2])
+        return {'model': self.import_model_name,
+                'fields': field_plan_dict,
+                'relations': relation_plan_dict}
+
+    @classmethod
+    def from_plan_dict(cls, plan_dict):
+        """Build a ModelImportInfo from an import plan (see
+        ``get_plan_dict``)."""
+        field_value_dict = {}
+        for full_field_name, field_plan in plan_dict['fields'].items():
+            field_value_dict[full_field_name + '-xls_column'] = str(field_plan.get('column', -1))
+            field_value_dict[full_field_name + '-is_id_field'] = field_plan.get('identity', False)
+            field_value_dict[full_field_name + '-default_value'] = field_plan.get('default', u'')
+            field_value_dict[full_field_name + '-mapping_choice'] = field_plan.get('mapping', u'')
+        relation_info_dict = {}
+        for full_field_name, (related_app_name, related_model_name) in plan_dict['relations'].items():
+            relation_info_dict[full_field_name] = (related_app_name, related_model_name, [])
+        return cls(plan_dict['model'], field_value_dict, relation_info_dict)
+
+    def get_import_copy(self):
+        """Return a copy of this ModelImportInfo for an import run. The copy
+        shares the field dictionaries and the compiled column plans, but has
+        its own per-import state (related object cache, related tables,
+        lookup strategies, value override caches and counters), so that
+        imports running at the same time don't share it."""
+        import_info = object.__new__(self.__class__)
+        import_info.__dict__.update(self.__dict__)
+        import_info.reset_related_object_cache()
+        import_info.field_value_override_dict = dict([(model_name, dict([(base_field_name, override.copy())
+                                                                         for base_field_name, override in override_dict.items()]))
+                                                      for model_name, override_dict in self.field_value_override_dict.items()])
+        return import_info
+
+    def __getstate__(self):
+        # The related object cache is only meaningful for the duration of an
+        # import, don't store it along with the rest of the import info (in
+        # the session, for example).
+        state = self.__dict__.copy()
+        state.pop('related_object_cache', None)
+        state.pop('related_table_dict', None)
+        state.pop('related_lookup_strategy_dict', None)
+        state.pop('related_table_hits', None)
+        state.pop('related_table_misses', None)
+        # Resolved overrides can be closures or lambdas, which can't be
+        # pickled: resolve them again when unpickling.
+        state.pop('field_value_override_dict', None)
+        # Same for the column plans, which hold the value converters.
+        state.pop('column_plan_by_model', None)
+        state.pop('default_plan_by_model', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._resolve_value_overrides()
+        self._compile_column_plans()
+
+    def _resolve_value_overrides(self):
+        """Turn the BATCHIMPORT_VALUE_OVERRIDES entries for the fields of the
+        imported model(s) into functions taking the request and the cell
+        value, once and for all (see ``resolve_value_override``)."""
+        self.field_value_override_dict = {}
+        for full_model_name, model in zip(self.model_name_list, self.model_list):
+            override_dict = {}
+            for base_field_name, override in BATCHIMPORT_VALUE_OVERRIDES.get(full_model_name, {}).items():
+                if base_field_name in self.base_field_names_by_model[model.__name__]:
+                    override_dict[base_field_name] = resolve_value_override(override,
+                                                                            full_model_name + '.' + base_field_name)
+            self.field_value_override_dict[model.__name__] = override_dict
+
+    def reset_related_object_cache(self):
+        """Start a new related object cache, and forget any related table
+        loaded and lookup strategy chosen (see ``get_field_value``). This
+        should be called at the start of each import run."""
+        self.related_object_cache = LRUCache(BATCHIMPORT_RELATED_OBJECT_CACHE_SIZE)
+        self.related_table_dict = {}
+        self.related_lookup_strategy_dict = {}
+        # Lookups answered by the related tables loaded for the 'prefetch'
+        # strategy, and number of tables loaded.
+        self.related_table_hits = 0
+        self.related_table_misses = 0
+
+    def get_related_lookup_strategy(self, model_name, base_field_name):
+        """Return the strategy used to look up related objects for the given
+        field: the one set in BATCHIMPORT_RELATED_LOOKUP_STRATEGIES if any,
+        'prefetch' if the related table is small enough and 'batch' if not.
+        The related table is counted only once per import."""
+        if not hasattr(self, 'related_lookup_strategy_dict'):
+            self.reset_related_object_cache()
+        try:
+            return self.related_lookup_strategy_dict[(model_name, base_field_name)]
+        except KeyError:
+            pass
+        strategy = self.related_lookup_strategy_override_dict.get(model_name, {}).get(base_field_name)
+        if not strategy:
+            related_app_name, related_model_name, mapping_field_name = self.related_model_info_by_field_name_dict[model_name][base_field_name]
+            related_model_class = get_model(related_app_name, related_model_name)
+            if related_model_class.objects.count() <= BATCHIMPORT_RELATED_PREFETCH_MAX_ROWS:
+                strategy = ModelImportInfo.RELATED_LOOKUP_PREFETCH
+            else:
+                strategy = ModelImportInfo.RELATED_LOOKUP_BATCH
+        self.related_lookup_strategy_dict[(model_name, base_field_name)] = strategy
+        return strategy
+
+    def prefetch_related_objects(self, row_list_list, model_name=None):
+        """Look up, in one query per related field, the related objects for
+        all the given spreadsheet rows, for the related fields using the
+        'batch' lookup strategy. The objects found (or not found) are put in
+        the related object cache, where ``get_field_value`` will find them.
+        This is only an optimization: if a value can't be used in a lookup,
+        the values are simply looked up one by one later."""
+        model_name = model_name or self.model_for_import.__name__
+        if not hasattr(self, 'related_object_cache'):
+            self.reset_related_object_cache()
+        for col, base_field_name in self.field_name_by_col_dict[model_name].items():
+            if not base_field_name in self.related_model_info_by_field_name_dict[model_name].keys():
+                continue
+            try:
+                if not self.get_related_lookup_strategy(model_name, base_field_name) == ModelImportInfo.RELATED_LOOKUP_BATCH:
+                    continue
+                related_app_name, related_model_name, mapping_field_name = self.related_model_info_by_field_name_dict[model_name][base_field_name]
+                default_value = self.default_by_field_name_dict[model_name].get(base_field_name)
+                lookup_value_dict = {}
+                for row_list in row_list_list:
+                    if int(col) < len(row_list):
+                        field_value = format_date_value(row_list[int(col)]) or default_value
+                    else:
+                        field_value = default_value
+                    if field_value:
+                        lookup_value = unicode(field_value)
+                        cache_key = (related_app_name, related_model_name, mapping_field_name, _get_lookup_key(lookup_value))
+                        if not cache_key in self.related_object_cache:
+                            lookup_value_dict[cache_key] = lookup_value
+                if not lookup_value_dict:
+                    continue
+                related_model_class = get_model(related_app_name, related_model_name)
+                cache_key_list = lookup_value_dict.keys()
+                connection = connections[related_model_class.objects.db]
+                lookup_batch_size = max(connection.ops.bulk_batch_size([mapping_field_name], cache_key_list), 1)
+                for index in range(0, len(cache_key_list), lookup_batch_size):
+                    related_object_dict = dict([(cache_key, None) for cache_key in cache_key_list[index:index+lookup_batch_size]])
+                    query = Q()
+                    for cache_key in related_object_dict.keys():
+                        query |= Q(**{str(mapping_field_name+'__iexact'): lookup_value_dict[cache_key]})
+                    found_key_list = []
+                    for related_object in related_model_class.objects.filter(query):
+                        cache_key = (related_app_name, related_model_name, mapping_field_name,
+                                     _get_lookup_key(getattr(related_object, mapping_field_name)))
+                        if cache_key in related_object_dict:
+                            # Several objects matching the same value is an
+                            # error, just like it would be for get().
+                            if cache_key in found_key_list:
+                                related_object_dict[cache_key] = None
+                            else:
+                                related_object_dict[cache_key] = related_object
+                                found_key_list.append(cache_key)
+                    for cache_key, related_object in related_object_dict.items():
+                        self.related_object_cache.set(cache_key, related_object)
+            except (ValueError, TypeError):
+                pass
+
+    def _get_related_table(self, related_app_name, related_model_name, mapping_field_name):
+        """Load the whole related table, as a dictionary of related objects
+        keyed by their case-folded mapping field value (None for values that
+        match several objects), which mimics the __iexact lookup."""
+        table_key = (related_app_name, related_model_name, mapping_field_name)
+        try:
+            return self.related_table_dict[table_key]
+        except KeyError:
+            pass
+        related_table = {}
+        related_model_class = get_model(related_app_name, related_model_name)
+        for related_object in related_model_class.objects.all():
+            mapping_value = _get_lookup_key(getattr(related_object, mapping_field_name))
+            if mapping_value in related_table:
+                related_table[mapping_value] = None
+            else:
+                related_table[mapping_value] = related_object
+        self.related_table_dict[table_key] = related_table
+        self.related_table_misses += 1
+        return related_table
+
+    def reset_value_override_stats(self):
+        """Forget the cached results and the counters of the value overrides.
+        This should be called at the start of each import run."""
+        for override_dict in self.field_value_override_dict.values():
+            for override in override_dict.values():
+                override.reset()
+
+    def get_value_override_stats(self):
+        """Return a list of dictionaries holding the name, number of calls,
+        number of cache hits and time spent (in seconds) of each value
+        override function (constant overrides are left out)."""
+        stats_dict_list = []
+        for override_dict in self.field_value_override_dict.values():
+            for override in override_dict.values():
+                if not override.is_constant:
+                    stats_dict_list.append(override.get_stats_dict())
+        return sorted(stats_dict_list, key=lambda stats_dict: stats_dict['name'])
+
+    def get_related_object_cache_stats(self):
+        """Return the (hits, misses) counters of the related object lookups:
+        lookups answered by the related object cache or a related table,
+        and lookups (or related table loads) that queried the database."""
+        if not hasattr(self, 'related_object_cache'):
+            return 0, 0
+        return (self.related_object_cache.hits + self.related_table_hits,
+                self.related_object_cache.misses + self.related_table_misses)
+
+    def get_identity_column_index_list(self, model_name=None):
+        """Return the sorted list of indexes of the spreadsheet columns mapped
+        to identity fields of the given model (all the mapped columns if no
+        identity field has one)."""
+        model_name = model_name or self.model_for_import.__name__
+        column_index_list = []
+        all_column_index_list = []
+        for col, base_field_name in self.field_name_by_col_dict[model_name].items():
+            if int(col) < 0:
+                continue
+            all_column_index_list.append(int(col))
+            if base_field_name in self.id_field_names_by_model_dict[model_name]:
+                column_index_list.append(int(col))
+        return sorted(column_index_list or all_column_index_list)
+
     def get_import_object_dicts(self, request, row_list):
         """Generate a dictionary of name:value entries in a dictionary
         that can be used later for obtaining an object from a manager."""
         return self._get_object_dicts(request, row_list, self.model_for_import.__name__)
 
+    def get_unresolved_related_values(self, request, row_list, model_name=None):
+        """Return the list of (field name, value) tuples of the related
+        fields whose value in the given spreadsheet row (or default value)
+        doesn't match any related object. The import leaves these fields
+        empty, this is used to report them when validating. Fields with a
+        value override are left out."""
+        model_name = model_name or self.model_for_import.__name__
+        unresolved_value_list = []
+        row_length = len(row_list)
+        for plan, from_row in ((self.column_plan_by_model[model_name], True),
+                               (self.default_plan_by_model[model_name], False)):
+            for col, base_field_name, is_id_field, default_value, needs_lookup, converter in plan:
+                if not base_field_name in self.related_model_info_by_field_name_dict[model_name] or \
+                   base_field_name in self.field_value_override_dict[model_name]:
+                    continue
+                if from_row and col < row_length:
+                    cell_value = format_date_value(row_list[col])
+                else:
+                    cell_value = None
+                # Lookups are cached, this doesn't cost another query.
+                if (cell_value or default_value) and \
+                   self.get_field_value(request, base_field_name, model_name, cell_value) is None:
+                    unresolved_value_list.append((base_field_name, cell_value or default_value))
+        return unresolved_value_list
+
     def get_relationship_source_id_dict(self, request, row_list):
         """Generate a dictionary of name:value entries in a dictionary
         that can be used later for obtaining an object from a manager."""
@@ -320,33 +855,90 @@ class ModelImportInfo(object):
         return self._get_object_dicts(request, row_list, self.target_model.__name__)[1]
 
 
+    def _compile_column_plans(self):
+        """Work out once, for each model, which field each mapped column goes
+        to and which fields only get a default (or override) value, so that
+        ``_get_object_dicts`` doesn't have to search the field dictionaries
+        for every cell of every row.
+
+        The plans are lists of (column index, field name, is identity field,
+        default value, needs lookup, converter) tuples, sorted by column index
+        (the column index is None for the fields which aren't mapped to a
+        column). Fields which need a lookup (related and overridden fields)
+        go through ``get_field_value``, the value of the others is the cell
+        value or the default value, converted for the field if it is typed
+        (the converter is None otherwise, see batchimport.converters)."""
+        self.column_plan_by_model = {}
+        self.default_plan_by_model = {}
+        model_by_name = dict([(model.__name__, model) for model in self.model_list])
+        for model_name, base_field_name_list in self.base_field_names_by_model.items():
+            column_plan = []
+            default_plan = []
+            field_col_dict = {}
+            for col, base_field_name in self.field_name_by_col_dict[model_name].items():
+                if int(col) > -1:
+                    field_col_dict[base_field_name] = int(col)
+            for base_field_name in base_field_name_list:
+                if self.import_mode == ModelImportInfo.OBJECT_IMPORT:
+                    default_value = self.default_by_field_name_dict[model_name].get(base_field_name)
+                else:
+                    default_value = None
+                needs_lookup = base_field_name in self.related_model_info_by_field_name_dict[model_name] or \
+                               base_field_name in self.field_value_override_dict[model_name]
+                converter = None
+                if not needs_lookup:
+                    try:
+                        converter = get_field_converter(model_by_name[model_name]._meta.get_field(base_field_name))
+                    except FieldDoesNotExist:
+                        pass
+                plan_tuple = (field_col_dict.get(base_field_name),
+                              str(base_field_name),
+                              base_field_name in self.id_field_names_by_model_dict[model_name],
+                              default_value,
+                              needs_lookup,
+                              converter)
+                if plan_tuple[0] is None:
+                    default_plan.append(plan_tuple)
+                else:
+                    column_plan.append(plan_tuple)
+            column_plan.sort()
+            self.column_plan_by_model[model_name] = column_plan
+            self.default_plan_by_model[model_name] = default_plan
+
     def _get_object_dicts(self, request, row_list, model_name):
         """Generate a dictionary of name:value entries in a dictionary
         that can be used later for obtaining an object from a manager."""
         import_object_dict = {}
         import_object_id_dict = {}
-        total_field_list = []
-        total_field_list.extend(self.base_field_names_by_model[model_name])
-        # Get values for all the fields we can from the spreadsheet row...
-        for index, cell_value in enumerate(row_list):
-            if str(index) in self.field_name_by_col_dict[model_name].keys():
-                base_field_name = self.field_name_by_col_dict[model_name][str(index)]
-                total_field_list.remove(base_field_name)
-                field_value = self.get_field_value(request, base_field_name, model_name, cell_value)
-                if field_value:
-                    import_object_dict[str(base_field_name)] = field_value
-                    if base_field_name in self.id_field_names_by_model_dict[model_name]:
-                        import_object_id_dict[str(base_field_name)] = field_value
-            
-        # Now process the leftovers (fields for the current model whose value
-        # we can't get from the spreadsheet).
-        for base_field_name in total_field_list:
-            field_value = self.get_field_value(request, base_field_name, model_name, None)
-            if field_value:
-                import_object_dict[str(base_field_name)] = field_value
-                if base_field_name in self.id_field_names_by_model_dict[model_name]:
-                    import_object_id_dict[str(base_field_name)] = field_value
-            
+        row_length = len(row_list)
+        # Get values for all the fields we can from the spreadsheet row, then
+        # for the fields whose value we can't get from the spreadsheet (which
+        # includes the fields mapped to columns missing from the row).
+        for plan, from_row in ((self.column_plan_by_model[model_name], True),
+                               (self.default_plan_by_model[model_name], False)):
+            for col, base_field_name, is_id_field, default_value, needs_lookup, converter in plan:
+                if from_row and col < row_length:
+                    cell_value = row_list[col]
+                else:
+                    cell_value = None
+                if needs_lookup:
+                    field_value = self.get_field_value(request, base_field_name, model_name, format_date_value(cell_value))
+                    if not field_value:
+                        continue
+                else:
+                    field_value = cell_value or default_value
+                    if not field_value:
+                        continue
+                    # Empty cells are left out, but the converted value of
+                    # a cell may well be false (0, False).
+                    if converter is not None:
+                        field_value = converter(field_value)
+                    elif field_value.__class__ in DATE_VALUE_CLASSES:
+                        field_value = format_date_value(field_value)
+                import_object_dict[base_field_name] = field_value
+                if is_id_field:
+                    import_object_id_dict[base_field_name] = field_value
+
         if not import_object_id_dict:
             import_object_id_dict = import_object_dict
         return import_object_dict, import_object_id_dict
@@ -361,25 +953,33 @@ class ModelImportInfo(object):
         field_value = start_value or default_value
         if field_value and base_field_name in self.related_model_info_by_field_name_dict[model_name].keys():
             related_app_name, related_model_name, mapping_field_name = self.related_model_info_by_field_name_dict[model_name][base_field_name]
-            related_object_keyword_dict = {}
-            related_object_keyword_dict[str(mapping_field_name+'__iexact')] = str(field_value)
-            related_model_class = get_model(related_app_name, related_model_name)
+            if not hasattr(self, 'related_object_cache'):
+                self.reset_related_object_cache()
             try:
-                related_object = related_model_class.objects.get(**related_object_keyword_dict)
-                field_value = related_object
-            except:
+                lookup_value = unicode(field_value)
+                if self.get_related_lookup_strategy(model_name, base_field_name) == ModelImportInfo.RELATED_LOOKUP_PREFETCH:
+                    related_table = self._get_related_table(related_app_name, related_model_name, mapping_field_name)
+                    field_value = related_table.get(_get_lookup_key(lookup_value))
+                    self.related_table_hits += 1
+                else:
+                    # The lookup is case-insensitive, and so is the cache.
+                    # Objects that couldn't be found are cached (as None) too.
+                    cache_key = (related_app_name, related_model_name, mapping_field_name, _get_lookup_key(lookup_value))
+                    field_value = self.related_object_cache.get(cache_key, _NOT_CACHED)
+                    if field_value is _NOT_CACHED:
+                        related_object_keyword_dict = {}
+                        related_object_keyword_dict[str(mapping_field_name+'__iexact')] = lookup_value
+                        related_model_class = get_model(related_app_name, related_model_name)
+                        try:
+                            field_value = related_model_class.objects.get(**related_object_keyword_dict)
+                        except (ObjectDoesNotExist, MultipleObjectsReturned):
+                            field_value = None
+                        self.related_object_cache.set(cache_key, field_value)
+            except (ValueError, TypeError):
+                # The value can't be used to look up the related object.
                 field_value = None
         # Check for override field value and substitute it if available.
-        try:
-            field_value = self.field_value_override_dict[model_name][base_field_name]
-            # Check to see if this references a function and if so, call it.
-            override_items = field_value.split('.')
-            if len(override_items) > 1:
-                override_value_function_name = override_items[-1]
-                override_value_module_name = '.'.join(override_items[:-1])
-                override_value_module = __import__(override_value_module_name, fromlist=[override_value_function_name])
-                override_value_function=getattr(override_value_module, override_value_function_name)
-                field_value = override_value_function(request, start_value) 
-        except:
-            pass
+        override = self.field_value_override_dict[model_name].get(base_field_name)
+        if override is not None:
+            field_value = override(request, start_value)
         return field_value
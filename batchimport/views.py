@@ -5,28 +5,38 @@ a model is present.
 """
 import sys
 import os
+import json
+import hashlib
 
 from os.path import join, isfile
 
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.views.generic.edit import FormView
-from django.shortcuts import render_to_response
-
-import xlrd
+from django.shortcuts import render_to_response, get_object_or_404
 
+from batchimport import jobs
+from batchimport.models import ImportJob
+from batchimport.plans import save_import_plan, get_import_info
+from batchimport.progress import ImportProgress, get_progress
+from batchimport.results import ImportResultLog, RESULT_KINDS_BY_LIST_NAME
 from batchimport.utils import ModelImportInfo
 from batchimport.forms import UploadImportFileForm
 from batchimport.forms import ImportOptionsForm
 from batchimport.batchimport_settings import *
-from batchimport.parser import _do_batch_import
+from batchimport.parser import _init_status_dict, _do_import, _report_import_error
 
 def handle_uploaded_file(f,target):
+    """Write the uploaded file ``f`` to ``target``, and return the hash of
+    its content (see batchimport.utils.get_sheet_info)."""
+    file_hash = hashlib.sha1()
     with open(target, 'wb+') as destination:
         for chunk in f.chunks():
             destination.write(chunk)
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
 class ImportUploadView(FormView):
     template_name = "batchimport/upload.html"
@@ -34,11 +44,12 @@ class ImportUploadView(FormView):
     options_url = "batchimport_options"
 
     def form_valid(self,form):
-        handle_uploaded_file(self.request.FILES['import_file'],
-                             join(BATCHIMPORT_TEMPDIR,
-                                  self.request.FILES['import_file'].name))
+        file_hash = handle_uploaded_file(self.request.FILES['import_file'],
+                                         join(BATCHIMPORT_TEMPDIR,
+                                              self.request.FILES['import_file'].name))
         
         self.request.session['batchimport_file_name'] = str(self.request.FILES['import_file'].name)
+        self.request.session['batchimport_file_hash'] = file_hash
         self.request.session['batchimport_model'] = str(form.cleaned_data['model_for_import'])
         self.request.session.modified = True
 
@@ -67,6 +78,7 @@ class ImportOptionsView(FormView):
     def get_form(self, form_class):
         return form_class(self.import_model,
                           self.import_file_name,
+                          file_hash=self.request.session.get('batchimport_file_hash'),
                           **self.get_form_kwargs())
 
 
@@ -84,7 +96,9 @@ class ImportOptionsView(FormView):
                                             model_field_value_dict,
                                             form.relation_info_dict)
         
-        self.request.session['batchimport_info'] = model_import_info        
+        # Only the key of the import plan goes in the session (see
+        # batchimport.plans).
+        self.request.session['batchimport_plan'] = save_import_plan(model_import_info)
         self.request.session.modified = True
 
         return render_to_response(self.processing_template_name)
@@ -92,23 +106,40 @@ class ImportOptionsView(FormView):
 class ImportRunView(TemplateView):
     template_name = "batchimport/run.html"
     upload_url = "batchimport_upload"
+    job_url = "batchimport_job"
 
     def dispatch(self, request, *args, **kwargs):
         try:
             self.import_file_name = request.session['batchimport_file_name']
             self.import_model = request.session['batchimport_model']
             self.import_options = request.session['batchimport_options']
-            self.import_info = request.session['batchimport_info']
+            self.import_info = get_import_info(request.session['batchimport_plan'])
 
-            self.init_status_dict()
+            # ?resume=1 resumes an interrupted import from its checkpoint.
+            self.resume = bool(request.GET.get('resume'))
         except KeyError, e:
             print "django-batchimport: session data key error: %s " % e
             return HttpResponseRedirect(reverse(self.upload_url))
 
         return super(ImportRunView, self).dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        if jobs.is_enabled():
+            # Run the import in the background, and send the user to the
+            # page following its progress.
+            job = jobs.submit_import_job(self.import_file_name,
+                                         self.import_model,
+                                         self.import_options,
+                                         self.import_info)
+            self.clear_session()
+            return HttpResponseRedirect(reverse(self.job_url, kwargs={'job_id': job.pk}))
+        return super(ImportRunView, self).get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super(ImportRunView, self).get_context_data(**kwargs)
+        # Only imports run here use the status of the session (background
+        # jobs keep their own), which must not be reset otherwise.
+        self.init_status_dict()
         self.run_import()
         for key, value in self.status_dict.items():
             context[key] = value
@@ -116,66 +147,35 @@ class ImportRunView(TemplateView):
         return context
 
     def init_status_dict(self):
-        status_dict = {}
-
-        status_dict['start_row'] = self.import_options['start_row']
-        status_dict['end_row'] = self.import_options['end_row']
-
-        status_dict['row_count'] = 0
-        status_dict['processed_count'] = 0
-        
-        status_dict['imported_count'] = 0
-        status_dict['updated_count'] = 0
-
-        status_dict['combined_messages'] = []
-        status_dict['import_messages'] = []
-        status_dict['update_messages'] = []
-        status_dict['error_messages'] = []
-
-        self.status_dict = status_dict
+        self.status_dict = _init_status_dict(self.import_options, get_session_import_id(self.request),
+                                             self.resume)
 
     def run_import(self):
-        # Open Excel file
         filepath = join(BATCHIMPORT_TEMPDIR, self.import_file_name)
+        progress = ImportProgress(get_session_import_id(self.request),
+                                  start_count=self.status_dict['processed_count'])
 
         try:
-            book = xlrd.open_workbook(filepath)
-            sheet = book.sheet_by_index(0)
-            self.status_dict['row_count'] = sheet.nrows
-
-            # Determine the last row of the spreadsheet to be processed.
-            if self.import_options['end_row'] == -1:
-                self.import_options['end_row'] = sheet.nrows
-                self.status_dict['end_row'] = self.import_options['end_row']
-
-            if self.import_info.import_mode == ModelImportInfo.OBJECT_IMPORT:
-                self.status_dict = _do_batch_import(self.request,
-                                                    self.import_info,
-                                                    book,
-                                                    sheet,
-                                                    self.import_options,
-                                                    self.status_dict)
-            else:
-                self.status_dict = _do_relation_import(self.request,
-                                                       self.import_info,
-                                                       book,
-                                                       sheet,
-                                                       self.import_options,
-                                                       self.status_dict)
+            self.status_dict = _do_import(self.request,
+                                          self.import_info,
+                                          filepath,
+                                          self.import_options,
+                                          self.status_dict,
+                                          progress)
         except Exception, e:
             # Report error
             print e
-            self.status_dict['error_messages'].append({ 'name' : 'Import Error',
-                                                        'critical' : 'Yes',
-                                                        'description' : '%s' % str(sys.exc_info()[1]),
-                                                        'info' : ['File : %s' % filepath,
-                                                                  'Exception : %s' % str(type(e)) ]})
+            _report_import_error(filepath, e, self.status_dict)
+        progress.finish(self.status_dict)
+        self.status_dict['result_log'].close()
 
-        del self.request.session['batchimport_file_name']
-        del self.request.session['batchimport_model']
-        del self.request.session['batchimport_options']
-        del self.request.session['batchimport_info']
-        self.request.session.modified = True
+        # An interrupted import keeps its session and file, so that it can
+        # be resumed.
+        if self.status_dict['interrupted']:
+            self.status_dict['resumable'] = True
+            return
+
+        self.clear_session()
 
         try:
             os.remove(filepath)
@@ -183,3 +183,125 @@ class ImportRunView(TemplateView):
             pass
         
         return
+
+    def clear_session(self):
+        del self.request.session['batchimport_file_name']
+        del self.request.session['batchimport_model']
+        del self.request.session['batchimport_options']
+        del self.request.session['batchimport_plan']
+        self.request.session.pop('batchimport_file_hash', None)
+        self.request.session.modified = True
+
+class ImportJobView(TemplateView):
+    """
+    Shows the status of an import running in the background, and its
+    results once it is finished.
+
+    """
+    template_name = "batchimport/job.html"
+
+    def get_context_data(self, **kwargs):
+        context = super(ImportJobView, self).get_context_data(**kwargs)
+        job = get_object_or_404(ImportJob, pk=kwargs['job_id'])
+        context['job'] = job
+        context['model_for_import'] = job.model_for_import
+        context['error_messages'] = job.get_error_messages()
+        context['progress'] = get_progress(job.get_import_id())
+        return context
+
+
+class ImportJobResumeView(View):
+    """
+    Resumes the import of the background job whose primary key is given in
+    the ``job_id`` URL keyword argument from its last checkpoint (see
+    batchimport.jobs.resume_import_job), if it failed or is stalled, and
+    sends the user back to the page following the job.
+
+    """
+    job_url = "batchimport_job"
+
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(ImportJob, pk=kwargs['job_id'])
+        jobs.resume_import_job(job)
+        return HttpResponseRedirect(reverse(self.job_url, kwargs={'job_id': job.pk}))
+
+
+class ImportProgressView(View):
+    """
+    Returns the last published progress (see batchimport.progress) of an
+    import as JSON: the import running in the background as the job whose
+    primary key is given in the ``job_id`` URL keyword argument, or the
+    import running in ImportRunView for the current session if there is no
+    ``job_id``.
+
+    """
+    def get(self, request, *args, **kwargs):
+        if kwargs.get('job_id'):
+            job = get_object_or_404(ImportJob, pk=kwargs['job_id'])
+            progress_dict = get_progress(job.get_import_id()) or {}
+            progress_dict['status'] = job.status
+        else:
+            progress_dict = get_progress(get_session_import_id(request)) or {}
+        return HttpResponse(json.dumps(progress_dict), content_type='application/json')
+
+
+class ImportResultsView(View):
+    """
+    Returns a page of the result log (see batchimport.results) of an import
+    as JSON: the import run as the background job whose primary key is given
+    in the ``job_id`` URL keyword argument, or the last import run in
+    ImportRunView for the current session if there is no ``job_id``.
+
+    The ``list`` query parameter selects the messages ('combined', 'import',
+    'update' or 'error', all of them by default), and the ``offset`` and
+    ``limit`` query parameters select the page (at most ``max_limit``
+    messages).
+
+    """
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        if kwargs.get('job_id'):
+            import_id = get_object_or_404(ImportJob, pk=kwargs['job_id']).get_import_id()
+        else:
+            import_id = get_session_import_id(request)
+        kind_list = RESULT_KINDS_BY_LIST_NAME.get(request.GET.get('list'))
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = min(max(int(request.GET.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            offset, limit = 0, self.default_limit
+        message_list = list(ImportResultLog(import_id).iter_messages(kind_list, offset, limit))
+        result_dict = {'offset': offset,
+                       'messages': message_list,
+                       'next_offset': offset + limit if len(message_list) == limit else None}
+        return HttpResponse(json.dumps(result_dict), content_type='application/json')
+
+
+class ImportResultsDownloadView(View):
+    """
+    Streams the result log (see batchimport.results) of an import as a CSV
+    report with one line per row: row index, action ('imported', 'updated',
+    'unchanged' or 'error'), primary key of the object and description. The
+    import is selected as in ImportResultsView, and so are the messages
+    (using the ``list`` query parameter, 'error' to only get the rows that
+    failed, for example).
+
+    """
+    def get(self, request, *args, **kwargs):
+        if kwargs.get('job_id'):
+            import_id = get_object_or_404(ImportJob, pk=kwargs['job_id']).get_import_id()
+        else:
+            import_id = get_session_import_id(request)
+        kind_list = RESULT_KINDS_BY_LIST_NAME.get(request.GET.get('list'))
+        response = StreamingHttpResponse(ImportResultLog(import_id).iter_report_lines(kind_list),
+                                         content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="batchimport_results_%s.csv"' % import_id
+        return response
+
+
+def get_session_import_id(request):
+    """Identifier used to publish the progress of the import running in
+    ImportRunView for the session of ``request``."""
+    return 'session-%s' % request.session.session_key
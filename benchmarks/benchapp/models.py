@@ -0,0 +1,38 @@
+"""
+Models used by the benchmarks: a narrow model, a wide model (both made of
+plain fields only) and a model with a foreign key and a many-to-many
+relation.
+
+"""
+from django.db import models
+
+
+class Narrow(models.Model):
+    code = models.CharField(max_length=32)
+    name = models.CharField(max_length=100, null=True)
+    quantity = models.IntegerField(null=True)
+
+
+WIDE_FIELD_COUNT = 30
+
+
+class Wide(models.Model):
+    code = models.CharField(max_length=32)
+
+for field_index in range(WIDE_FIELD_COUNT):
+    Wide.add_to_class('field%02d' % field_index, models.CharField(max_length=100, null=True))
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100)
+
+
+class Item(models.Model):
+    code = models.CharField(max_length=32)
+    name = models.CharField(max_length=100, null=True)
+    category = models.ForeignKey(Category, null=True)
+    tags = models.ManyToManyField(Tag)
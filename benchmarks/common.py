@@ -0,0 +1,75 @@
+"""
+Helpers shared by the benchmarks.
+
+"""
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def setup_django():
+    """Make the bundled settings, models and batchimport importable, and
+    create the tables of the bundled models."""
+    for path in (BENCHMARKS_DIR, os.path.dirname(BENCHMARKS_DIR)):
+        if not path in sys.path:
+            sys.path.insert(0, path)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def get_full_model_name(model):
+    return '.'.join([model.__module__, model.__name__])
+
+
+def build_import_info(model, column_field_name_list, id_field_name_list=(),
+                      default_by_field_name=None, mapping_by_field_name=None):
+    """
+    Build a ModelImportInfo the way ImportOptionsView does it, for a
+    spreadsheet whose columns are mapped, in order, to the fields named in
+    ``column_field_name_list``.
+
+    """
+    from batchimport.utils import ModelImportInfo, get_model_fields
+
+    default_by_field_name = default_by_field_name or {}
+    mapping_by_field_name = mapping_by_field_name or {}
+    model_name = get_full_model_name(model)
+    field_value_dict = {}
+    relation_info_dict = {}
+    for field_tuple in get_model_fields(model_name):
+        base_field_name = field_tuple[0]
+        field_name = base_field_name.rstrip('*')
+        full_field_name = model_name + '.' + base_field_name
+        if field_name in column_field_name_list:
+            field_value_dict[full_field_name + '-xls_column'] = str(column_field_name_list.index(field_name))
+        else:
+            field_value_dict[full_field_name + '-xls_column'] = '-1'
+        field_value_dict[full_field_name + '-is_id_field'] = field_name in id_field_name_list
+        field_value_dict[full_field_name + '-default_value'] = default_by_field_name.get(field_name, u'')
+        field_value_dict[full_field_name + '-mapping_choice'] = mapping_by_field_name.get(field_name, u'')
+        relation_info_dict[full_field_name] = (field_tuple[1], field_tuple[2],
+                                               [(name, name) for name in field_tuple[3]])
+    return ModelImportInfo(model_name, field_value_dict, relation_info_dict)
+
+
+def build_relation_import_info(model, relation_field_name, related_model,
+                               id_field_name, related_id_field_name):
+    """
+    Build a ModelImportInfo for the import of the ``relation_field_name``
+    many-to-many relation of ``model``, for a spreadsheet whose first column
+    holds the ``id_field_name`` of the objects of ``model`` and whose second
+    column holds the ``related_id_field_name`` of the related objects.
+
+    """
+    from batchimport.utils import ModelImportInfo
+
+    model_name = get_full_model_name(model)
+    related_model_name = get_full_model_name(related_model)
+    field_value_dict = {model_name + '.' + id_field_name + '-xls_column': '0',
+                        model_name + '.' + id_field_name + '-is_id_field': True,
+                        related_model_name + '.' + related_id_field_name + '-xls_column': '1',
+                        related_model_name + '.' + related_id_field_name + '-is_id_field': True}
+    return ModelImportInfo('%'.join([model_name, 'relation' + relation_field_name, related_model_name]),
+                           field_value_dict, {})
@@ -0,0 +1,343 @@
+"""
+End-to-end benchmarks of object imports, updates and relationship imports
+(``_do_batch_import`` and ``_do_relation_import``), reading synthetic
+spreadsheets into the bundled models.
+
+Each scenario is the combination of a mode ('create' imports the rows into
+an empty table, 'update' imports them over existing objects whose fields
+all change, 'relation' links existing objects through a many-to-many
+relation), a shape ('narrow', 'wide' or 'fk', a narrow model with a foreign
+key looked up by name; the relation mode has a single shape), a file format
+('csv', 'xls' or 'xlsx') and a number of rows. The spreadsheets are
+generated once and kept in the data directory, so that runs are
+comparable.
+
+Every scenario runs in a fresh process, on an empty database, so that the
+peak RSS reported for it only accounts for that scenario. The results are
+written to the standard output (or to the --output file) as JSON lines,
+one per scenario, holding the throughput (``rows_per_second``), the number
+of queries per row and the peak RSS (``peak_rss_kb``, along with the RSS
+reached before the import started, ``baseline_rss_kb``).
+
+Run it with:
+
+    python benchmarks/imports.py [--rows 10000,100000,1000000] [--formats csv,xls,xlsx]
+                                 [--shapes narrow,wide,fk] [--modes create,update,relation]
+                                 [--bulk-create] [--output results.jsonl]
+
+XLS files can't hold more than 65536 rows, these scenarios are reported as
+skipped (as are the ones whose format needs a missing library: xlwt to
+write XLS files, openpyxl to write XLSX files). See benchmarks/settings.py
+to run the benchmarks against another database.
+
+"""
+import csv
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from common import setup_django, build_import_info, build_relation_import_info
+
+MODES = ('create', 'update', 'relation')
+SHAPES = ('narrow', 'wide', 'fk')
+FORMATS = ('csv', 'xls', 'xlsx')
+XLS_MAX_ROWS = 65536
+
+# Number of categories (looked up by the 'fk' shape) and tags (linked by
+# the relation mode).
+CATEGORY_COUNT = 100
+TAG_COUNT = 100
+
+
+def get_column_name_list(shape):
+    from benchapp.models import WIDE_FIELD_COUNT
+
+    if shape == 'narrow':
+        return ['code', 'name', 'quantity']
+    if shape == 'wide':
+        return ['code'] + ['field%02d' % index for index in range(WIDE_FIELD_COUNT)]
+    if shape == 'fk':
+        return ['code', 'name', 'category']
+    return ['item', 'tag']
+
+
+def iter_row_values(shape, row_count):
+    """Yield the header and the rows of the spreadsheet of ``shape``."""
+    column_name_list = get_column_name_list(shape)
+    yield column_name_list
+    for row in range(row_count):
+        if shape == 'relation':
+            yield [u'code-%d' % row, u'tag-%d' % (row % TAG_COUNT)]
+        elif shape == 'fk':
+            yield [u'code-%d' % row, u'name-%d' % row, u'category-%d' % (row % CATEGORY_COUNT)]
+        elif shape == 'narrow':
+            # Numbers come out of spreadsheets as floats.
+            yield [u'code-%d' % row, u'name-%d' % row, float(row % 1000)]
+        else:
+            yield [u'code-%d' % row] + [u'%s-%d' % (column_name, row) for column_name in column_name_list[1:]]
+
+
+def get_data_path(data_dir, shape, file_format, row_count):
+    return os.path.join(data_dir, 'batchimport_benchmark_%s_%d.%s' % (shape, row_count, file_format))
+
+
+def write_data_file(path, shape, file_format, row_count):
+    """Write the spreadsheet of ``shape`` to ``path``, unless it's already
+    there."""
+    if os.path.exists(path):
+        return
+    temp_path = path + '.tmp'
+    if file_format == 'csv':
+        with open(temp_path, 'wb') as f:
+            writer = csv.writer(f)
+            for row_value_list in iter_row_values(shape, row_count):
+                writer.writerow([_format_csv_value(value) for value in row_value_list])
+    elif file_format == 'xls':
+        book = xlwt.Workbook()
+        sheet = book.add_sheet('data')
+        for row, row_value_list in enumerate(iter_row_values(shape, row_count)):
+            for col, value in enumerate(row_value_list):
+                sheet.write(row, col, value)
+        book.save(temp_path)
+    else:
+        # The write-only mode streams the rows to the file.
+        book = openpyxl.Workbook(write_only=True)
+        sheet = book.create_sheet()
+        for row_value_list in iter_row_values(shape, row_count):
+            sheet.append(row_value_list)
+        book.save(temp_path)
+    os.rename(temp_path, path)
+
+
+def _format_csv_value(value):
+    # Whole numbers are written without a decimal part, as spreadsheet
+    # applications do.
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return unicode(value).encode('utf-8')
+
+
+def get_skip_reason(scenario):
+    if scenario['format'] == 'xls' and scenario['rows'] >= XLS_MAX_ROWS:
+        return 'XLS files hold at most %d rows' % XLS_MAX_ROWS
+    if scenario['format'] == 'xls' and xlwt is None:
+        return 'xlwt is not installed'
+    if scenario['format'] == 'xlsx' and openpyxl is None:
+        return 'openpyxl is not installed'
+    return None
+
+
+class QueryCounter(object):
+    """Stands for ``connection.queries``, only counting the queries logged
+    by the debug cursor instead of keeping them in memory."""
+    def __init__(self):
+        self.count = 0
+
+    def append(self, query_dict):
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+
+def get_peak_rss_kb():
+    # ru_maxrss is carried over from the parent process on Linux, the peak
+    # RSS of this process is read from /proc when it is available.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return peak_rss
+
+
+def prepare_database(scenario):
+    """Create the objects the scenario imports into (or links)."""
+    from django.core.management import call_command
+    from django.db import connection
+    from benchapp.models import Narrow, Wide, Category, Tag, Item
+
+    if connection.settings_dict['NAME'] != ':memory:':
+        call_command('flush', interactive=False, verbosity=0)
+    row_count = scenario['rows']
+    Category.objects.bulk_create([Category(name=u'category-%d' % index) for index in range(CATEGORY_COUNT)])
+    Tag.objects.bulk_create([Tag(name=u'tag-%d' % index) for index in range(TAG_COUNT)])
+    if scenario['mode'] == 'create':
+        return
+    # The objects to update (or link) get different values than the ones
+    # in the spreadsheet.
+    model = {'narrow': Narrow, 'wide': Wide, 'fk': Item, 'relation': Item}[scenario['shape']]
+    field_name_list = [field_name for field_name in get_column_name_list(scenario['shape'])
+                       if field_name != 'code' and field_name in model._meta.get_all_field_names()]
+    value_by_field_name = {'quantity': -1, 'category': None}
+    for start in range(0, row_count, 10000):
+        model.objects.bulk_create([model(code=u'code-%d' % row,
+                                         **dict([(field_name, value_by_field_name.get(field_name, u'old'))
+                                                 for field_name in field_name_list]))
+                                   for row in range(start, min(start + 10000, row_count))])
+
+
+def get_import_info(scenario):
+    from benchapp.models import Narrow, Wide, Item, Tag
+
+    if scenario['mode'] == 'relation':
+        return build_relation_import_info(Item, 'tags', Tag, 'code', 'name')
+    model = {'narrow': Narrow, 'wide': Wide, 'fk': Item}[scenario['shape']]
+    return build_import_info(model, get_column_name_list(scenario['shape']), ['code'],
+                             mapping_by_field_name={'category': 'name'})
+
+
+def run_scenario(scenario):
+    """Run ``scenario`` in this process and return its results."""
+    setup_django()
+    from django.db import connection
+    from batchimport.parser import _init_status_dict, _do_batch_import, _do_relation_import
+    from batchimport.readers import get_reader
+    from batchimport.utils import ModelImportInfo
+
+    prepare_database(scenario)
+    model_import_info = get_import_info(scenario)
+    process_option_dict = {'show_successful_imports': False,
+                           'show_successful_updates': False,
+                           'stop_on_first_error': False,
+                           'update_dupes': scenario['mode'] != 'create',
+                           'start_row': 2,
+                           'end_row': scenario['rows'] + 1,
+                           'bulk_create': scenario['bulk_create'],
+                           'batch_size': scenario['batch_size'],
+                           'transaction_size': scenario['transaction_size']}
+    status_dict = _init_status_dict(process_option_dict)
+
+    query_counter = QueryCounter()
+    connection.queries = query_counter
+    connection.use_debug_cursor = True
+    baseline_rss_kb = get_peak_rss_kb()
+    start_time = time.time()
+    with get_reader(scenario['path']) as reader:
+        if model_import_info.import_mode == ModelImportInfo.OBJECT_IMPORT:
+            status_dict = _do_batch_import(None, model_import_info, reader, process_option_dict, status_dict)
+        else:
+            status_dict = _do_relation_import(None, model_import_info, reader, process_option_dict, status_dict)
+    seconds = time.time() - start_time
+    connection.use_debug_cursor = None
+
+    processed_count = status_dict['processed_count']
+    return dict(scenario,
+                processed_count=processed_count,
+                imported_count=status_dict['imported_count'],
+                updated_count=status_dict['updated_count'],
+                unchanged_count=status_dict['unchanged_count'],
+                error_count=status_dict['error_count'],
+                seconds=round(seconds, 3),
+                rows_per_second=round(processed_count / seconds, 1) if seconds else None,
+                queries=query_counter.count,
+                queries_per_row=round(float(query_counter.count) / processed_count, 4) if processed_count else None,
+                baseline_rss_kb=baseline_rss_kb,
+                peak_rss_kb=get_peak_rss_kb(),
+                database=connection.vendor)
+
+
+def run_scenario_process(scenario):
+    """Run ``scenario`` in a new process and return its results."""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(scenario)],
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return dict(scenario, error='the scenario process exited with status %d' % process.returncode)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def get_scenario_list(options):
+    scenario_list = []
+    for row_count in [int(value) for value in options.rows.split(',')]:
+        for mode in options.modes.split(','):
+            shape_list = ['relation'] if mode == 'relation' else options.shapes.split(',')
+            for shape in shape_list:
+                for file_format in options.formats.split(','):
+                    name_part_list = [mode] if mode == 'relation' else [mode, shape]
+                    scenario_list.append({'name': '-'.join(name_part_list + [file_format, str(row_count)]),
+                                          'mode': mode,
+                                          'shape': shape,
+                                          'format': file_format,
+                                          'rows': row_count,
+                                          'bulk_create': options.bulk_create,
+                                          'batch_size': options.batch_size,
+                                          'transaction_size': options.transaction_size})
+    return scenario_list
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--rows', default='10000',
+                      help='Comma separated numbers of rows (default: %default).')
+    parser.add_option('--modes', default=','.join(MODES),
+                      help='Comma separated modes (default: %default).')
+    parser.add_option('--shapes', default=','.join(SHAPES),
+                      help='Comma separated shapes of the object imports (default: %default).')
+    parser.add_option('--formats', default=','.join(FORMATS),
+                      help='Comma separated file formats (default: %default).')
+    parser.add_option('--bulk-create', action='store_true', default=False,
+                      help='Import with the bulk_create option.')
+    parser.add_option('--batch-size', type='int', default=None,
+                      help='Batch size (default: BATCHIMPORT_BATCH_SIZE).')
+    parser.add_option('--transaction-size', type='int', default=None,
+                      help='Transaction size (default: BATCHIMPORT_TRANSACTION_SIZE).')
+    parser.add_option('--data-dir', default=os.path.join(tempfile.gettempdir(), 'batchimport-benchmarks'),
+                      help='Directory where the spreadsheets are kept (default: %default).')
+    parser.add_option('--output', default=None,
+                      help='File the results are appended to (default: standard output).')
+    parser.add_option('--scenario', default=None, help='(internal) Run a single scenario.')
+    options, args = parser.parse_args()
+
+    if options.scenario:
+        print json.dumps(run_scenario(json.loads(options.scenario)))
+        return
+
+    setup_django()
+    if not os.path.isdir(options.data_dir):
+        os.makedirs(options.data_dir)
+    output = open(options.output, 'ab') if options.output else sys.stdout
+    environment_dict = {'python': platform.python_version(), 'platform': platform.platform()}
+    try:
+        for scenario in get_scenario_list(options):
+            skip_reason = get_skip_reason(scenario)
+            if skip_reason is not None:
+                result_dict = dict(scenario, skipped=skip_reason)
+            else:
+                scenario['path'] = get_data_path(options.data_dir, scenario['shape'],
+                                                 scenario['format'], scenario['rows'])
+                sys.stderr.write('%s...\n' % scenario['name'])
+                write_data_file(scenario['path'], scenario['shape'], scenario['format'], scenario['rows'])
+                result_dict = run_scenario_process(scenario)
+            result_dict.update(environment_dict)
+            output.write(json.dumps(result_dict, sort_keys=True) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
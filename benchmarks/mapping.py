@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of the per-row mapping step of object imports
+(ModelImportInfo.get_import_object_dicts), i.e. the CPU cost of turning a
+spreadsheet row into the object and identity dictionaries, without any
+database access.
+
+Run it with:
+
+    python benchmarks/mapping.py [rows]
+
+"""
+import sys
+import time
+
+from common import setup_django, build_import_info
+
+
+def run_scenario(name, model, column_field_name_list, id_field_name_list, row_count):
+    import_info = build_import_info(model, column_field_name_list, id_field_name_list)
+    row_list = [[get_cell_value(model, field_name, row) for field_name in column_field_name_list]
+                for row in range(row_count)]
+    get_import_object_dicts = import_info.get_import_object_dicts
+    start_time = time.time()
+    for row_value_list in row_list:
+        get_import_object_dicts(None, row_value_list)
+    elapsed = time.time() - start_time
+    print '%-8s %3d columns: %8.2f us/row' % (name, len(column_field_name_list),
+                                              elapsed * 1000000 / row_count)
+
+
+def get_cell_value(model, field_name, row):
+    # Numbers come out of spreadsheets as floats.
+    if model._meta.get_field(field_name).get_internal_type() == 'IntegerField':
+        return float(row % 100)
+    return u'%s-%d' % (field_name, row)
+
+
+def main(row_count):
+    setup_django()
+    from benchapp.models import Narrow, Wide, WIDE_FIELD_COUNT
+
+    run_scenario('narrow', Narrow, ['code', 'name', 'quantity'], ['code'], row_count)
+    wide_field_name_list = ['code'] + ['field%02d' % index for index in range(WIDE_FIELD_COUNT)]
+    run_scenario('wide', Wide, wide_field_name_list, ['code'], row_count)
+    # Half of the fields only get their default value.
+    run_scenario('wide/2', Wide, wide_field_name_list[:WIDE_FIELD_COUNT // 2], ['code'], row_count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,31 @@
+"""
+Django settings used to run the benchmarks against the bundled models.
+
+The database is an in-memory SQLite database by default; set the
+BENCHMARK_DATABASE environment variable to a JSON dictionary (such as
+'{"ENGINE": "django.db.backends.sqlite3", "NAME": "/tmp/bench.db"}') to run
+them against another database.
+
+"""
+import json
+import os
+
+DEBUG = False
+SECRET_KEY = 'batchimport-benchmarks'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+if os.environ.get('BENCHMARK_DATABASE'):
+    DATABASES['default'] = json.loads(os.environ['BENCHMARK_DATABASE'])
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'batchimport',
+    'benchapp',
+)
+
+BATCHIMPORT_TEMPDIR = '/tmp/'
@@ -17,6 +17,9 @@ setup(
     author='Hugo Geoffroy',
     author_email='batchimport@pstch.net',
     install_requires = ['xlrd==0.9.3'],
+    extras_require = {
+        'xlsx': ['openpyxl>=2.6'],
+    },
     packages = ['batchimport'],
     package_data = {
         'batchimport': ['templates/batchimport/*.html'],